@@ -21,12 +21,12 @@ CORS(app)
 logger = logging.getLogger(__name__)
 
 # Initialize managers and other components
-from app.vm import VMManager, VMConfig
+from app.vm import VMManager, VMConfig, VM, DISK_CACHE_MODES, WARM_IMAGE_IDS
 from app.vpc import VPCManager, VPCError
 from app.networking import NetworkManager, NetworkError
 from app.migration import MigrationManager, MigrationConfig, MigrationError
 from app.db import db
-from app.libvirt_utils import get_libvirt_connection
+from app.libvirt_utils import get_shared_libvirt_connection
 from app.ip_manager import IPManager
 from app.server_manager import ServerManager, Server
 from app.cluster_vm_manager import ClusterVMManager
@@ -39,11 +39,13 @@ from app.cluster_api import cluster_api, init_cluster_managers
 def init_managers():
     global network_manager, vpc_manager, vm_manager, migration_manager, ip_manager
     global server_manager, cluster_vm_manager, cluster_network_manager, cluster_storage_manager, cluster_monitoring
-    conn = get_libvirt_connection()
+    conn = get_shared_libvirt_connection()
     network_manager = NetworkManager(conn)
     vpc_manager = VPCManager(network_manager)
     ip_manager = IPManager()
     vm_manager = VMManager(network_manager=network_manager, ip_manager=ip_manager)
+    for image_id in WARM_IMAGE_IDS:
+        vm_manager.warm_image(image_id)
     migration_manager = MigrationManager(conn)
     
     # Initialize cluster managers
@@ -95,7 +97,7 @@ def check_architecture_compatibility():
     
     try:
         # Check QEMU/KVM support for current architecture
-        conn = get_libvirt_connection()
+        conn = get_shared_libvirt_connection()
         capabilities = conn.getCapabilities()
         
         return {
@@ -118,7 +120,7 @@ def check_architecture_compatibility():
 def health_check():
     try:
         # Check libvirt connection
-        conn = get_libvirt_connection()
+        conn = get_shared_libvirt_connection()
         conn.getVersion()
         
         # Check managers
@@ -181,6 +183,7 @@ class VMCreateSchema(Schema):
     image_id = fields.Str(required=True)
     cloud_init = fields.Nested(CloudInitConfigSchema, allow_none=True)
     arch = fields.Str(validate=validate.OneOf(['x86_64', 'aarch64']), allow_none=True)
+    disk_cache = fields.Str(validate=validate.OneOf(DISK_CACHE_MODES), allow_none=True)
 
 class VPCCreateSchema(Schema):
     name = fields.Str(required=True, validate=[
@@ -253,7 +256,12 @@ def validate_request(schema_class):
 @cache.cached(timeout=60, key_prefix=cache_key_prefix)
 def list_vms():
     try:
-        vms = vm_manager.list_vms()
+        # Optional pagination: ?limit=50&offset=100
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if (limit is not None and limit < 0) or offset < 0:
+            return jsonify({'error': 'limit and offset must be non-negative'}), 400
+        vms = vm_manager.list_vms(limit, offset)
         return jsonify({'vms': [asdict(vm) for vm in vms]})
     except Exception as e:
         logger.error(f"Error listing VMs: {str(e)}")
@@ -296,12 +304,19 @@ def create_vm():
             disk_size_gb=data['disk_size_gb'],
             image_id=data['image_id'],
             cloud_init=data.get('cloud_init'),
-            arch=data.get('arch')
+            arch=data.get('arch'),
+            disk_cache=data.get('disk_cache') or 'none'
         )
         
         existing_vm = vm_manager.get_vm(config.name)
         if existing_vm:
             return jsonify({'error': f"VM with name {config.name} already exists"}), 400
+        
+        # Image download and disk setup can take minutes; let callers opt
+        # into polling a job instead of holding the request open
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            job_id = vm_manager.create_vm_async(config)
+            return jsonify({'job_id': job_id, 'status': 'pending'}), 202
             
         vm = vm_manager.create_vm(config)
         return jsonify({'vm': asdict(vm)}), 201
@@ -310,12 +325,30 @@ def create_vm():
         logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/vms/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = vm_manager.get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        if isinstance(job['result'], VM):
+            job['result'] = asdict(job['result'])
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Error getting VM job: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/vms/<vm_id>', methods=['DELETE'])
 def delete_vm(vm_id):
     try:
         vm = vm_manager.get_vm(vm_id)
         if not vm:
             return jsonify({'error': 'VM not found'}), 404
+        
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            job_id = vm_manager.delete_vm_async(vm_id)
+            return jsonify({'job_id': job_id, 'status': 'pending'}), 202
             
         vm_manager.delete_vm(vm_id)
         return jsonify({'success': True, 'message': f"VM {vm_id} deleted successfully"})
@@ -404,18 +437,22 @@ def is_private_cidr(cidr: str) -> bool:
     except ValueError:
         return False
 
+# Private ranges random VPC CIDRs are drawn from, parsed once at import
+PRIVATE_NETWORKS = [
+    ipaddress.ip_network('10.0.0.0/8'),
+    ipaddress.ip_network('172.16.0.0/12'),
+    ipaddress.ip_network('192.168.0.0/16')
+]
+
 def generate_random_cidr() -> str:
     """Generate a random private network CIDR."""
-    private_ranges = [
-        '10.0.0.0/8',
-        '172.16.0.0/12',
-        '192.168.0.0/16'
-    ]
-    base_network = ipaddress.ip_network(random.choice(private_ranges))
-    # Generate a random subnet within the base network
+    base_network = random.choice(PRIVATE_NETWORKS)
+    # Pick a random subnet within the base network by index, rather than
+    # materializing every subnet (over a million /28s in 10.0.0.0/8)
     prefix_length = random.randint(16, 28)
-    subnets = list(base_network.subnets(new_prefix=prefix_length))
-    return str(random.choice(subnets))
+    index = random.randrange(1 << (prefix_length - base_network.prefixlen))
+    network_address = base_network.network_address + (index << (32 - prefix_length))
+    return f"{network_address}/{prefix_length}"
 
 @app.route('/api/vpcs', methods=['POST'])
 @validate_request(VPCCreateSchema)
@@ -554,7 +591,11 @@ def attach_disk_to_vm(vm_id):
         if not vm:
             return jsonify({'error': 'VM not found'}), 404
             
-        vm_manager.attach_disk(data['disk_id'], vm_id)
+        # Accept a list of disks so bulk attaches share one domain lookup
+        if 'disk_ids' in data:
+            vm_manager.attach_disks(data['disk_ids'], vm_id)
+        else:
+            vm_manager.attach_disk(data['disk_id'], vm_id)
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error attaching disk: {str(e)}")
@@ -569,7 +610,10 @@ def detach_disk_from_vm(vm_id):
         if not vm:
             return jsonify({'error': 'VM not found'}), 404
             
-        vm_manager.detach_disk(data['disk_id'])
+        if 'disk_ids' in data:
+            vm_manager.detach_disks(data['disk_ids'])
+        else:
+            vm_manager.detach_disk(data['disk_id'])
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error detaching disk: {str(e)}")
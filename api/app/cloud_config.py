@@ -0,0 +1,33 @@
+from collections import deque
+
+# cloud-init keys whose lists are sets of entries, so merging skips entries
+# already present. Other lists (runcmd, bootcmd, write_files, ...) are
+# ordered and are extended as given, repeats included
+CLOUD_INIT_SET_KEYS = frozenset({'packages', 'ssh_authorized_keys'})
+
+def merge_cloud_init(base: dict, custom: dict) -> None:
+    """Merge custom cloud-init config into base config in place.
+
+    Nested dicts are merged and lists are extended; lists under
+    CLOUD_INIT_SET_KEYS only gain the entries they don't already contain.
+    Uses an explicit stack rather than recursion so deep configs can't hit
+    RecursionError.
+    """
+    stack = deque([(base, custom)])
+    while stack:
+        target, source = stack.pop()
+        for key, value in source.items():
+            current = target.get(key)
+            if type(current) is dict and type(value) is dict:
+                stack.append((current, value))
+            elif type(current) is list and type(value) is list:
+                if key in CLOUD_INIT_SET_KEYS:
+                    # e.g. a package listed in both the defaults and the
+                    # custom config, or twice in one
+                    for item in value:
+                        if item not in current:
+                            current.append(item)
+                else:
+                    current.extend(value)
+            else:
+                target[key] = value
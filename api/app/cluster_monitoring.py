@@ -348,7 +348,9 @@ class ClusterMonitoring:
         
         for vm in vms:
             try:
-                vm_status = self.vm_manager.get_vm_status(vm.id)
+                # list_vms already filled in each VM's state; asking again
+                # per VM would open a manager and connection per VM
+                vm_status = vm.status
                 
                 if vm_status == "running":
                     metrics["running_vms"] += 1
@@ -480,7 +482,7 @@ class ClusterMonitoring:
         # Check each VM
         for vm in self.vm_manager.list_vms():
             # Skip non-running VMs
-            status = self.vm_manager.get_vm_status(vm.id)
+            status = vm.status
             if status != "running":
                 continue
             
@@ -775,7 +777,7 @@ class ClusterMonitoring:
         health["vms"]["total"] = len(vms)
         
         for vm in vms:
-            status = self.vm_manager.get_vm_status(vm.id)
+            status = vm.status
             if status == "running":
                 health["vms"]["running"] += 1
             elif status == "stopped":
@@ -1,9 +1,9 @@
 import os
-import time
 import uuid
 import json
 import logging
 import subprocess
+import threading
 from typing import Dict, List, Optional, Any, Tuple
 from pathlib import Path
 import libvirt
@@ -11,6 +11,7 @@ import libvirt
 from app.vm import LibvirtManager, VMConfig, VM, VMStatus, VMError
 from app.server_manager import ServerManager, Server, ServerError
 from app.ip_manager import IPManager
+from app.libvirt_utils import get_shared_libvirt_connection
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,10 @@ class ClusterVMManager:
         self.server_manager = server_manager
         self.ip_manager = ip_manager
         self.vm_servers = {}
+        # One LibvirtManager per libvirt URI, reused across requests so each
+        # server's connection, caches and worker pool are built only once
+        self._vm_managers: Dict[str, LibvirtManager] = {}
+        self._vm_managers_lock = threading.Lock()
         self._load_vm_server_mapping()
     
     def _load_vm_server_mapping(self) -> None:
@@ -68,8 +73,18 @@ class ClusterVMManager:
         
         return server
     
+    def _get_vm_manager(self, server: Server) -> LibvirtManager:
+        """Get the LibvirtManager for a server, creating it on first use."""
+        uri = server.get_libvirt_uri()
+        with self._vm_managers_lock:
+            vm_manager = self._vm_managers.get(uri)
+            if vm_manager is None:
+                vm_manager = LibvirtManager(ip_manager=self.ip_manager, uri=uri)
+                self._vm_managers[uri] = vm_manager
+            return vm_manager
+    
     def _get_vm_server(self, vm_id: str) -> Tuple[Server, LibvirtManager]:
-        """Get the server for a VM and initialize a LibvirtManager for it."""
+        """Get the server for a VM and its LibvirtManager."""
         if vm_id not in self.vm_servers:
             raise ClusterVMError(f"VM with ID {vm_id} not found in server mapping")
         
@@ -81,15 +96,7 @@ class ClusterVMManager:
             raise ClusterVMError(f"Error retrieving server for VM {vm_id}: {str(e)}")
         
         try:
-            libvirt_uri = server.get_libvirt_uri()
-            logger.info(f"Connecting to libvirt on server {server.name} at {libvirt_uri}")
-            
-            conn = libvirt.open(libvirt_uri)
-            if not conn:
-                raise ClusterVMError(f"Failed to connect to libvirt on server {server.name}")
-            
-            vm_manager = LibvirtManager(ip_manager=self.ip_manager)
-            vm_manager.conn = conn
+            vm_manager = self._get_vm_manager(server)
             
             return server, vm_manager
         except Exception as e:
@@ -102,13 +109,7 @@ class ClusterVMManager:
         logger.info(f"Selected server {server.name} for VM {config.name}")
         
         try:
-            libvirt_uri = server.get_libvirt_uri()
-            conn = libvirt.open(libvirt_uri)
-            if not conn:
-                raise ClusterVMError(f"Failed to connect to libvirt on server {server.name}")
-            
-            vm_manager = LibvirtManager(ip_manager=self.ip_manager)
-            vm_manager.conn = conn
+            vm_manager = self._get_vm_manager(server)
             
             vm = vm_manager.create_vm(config)
             
@@ -141,14 +142,7 @@ class ClusterVMManager:
                 continue
             
             try:
-                libvirt_uri = server.get_libvirt_uri()
-                conn = libvirt.open(libvirt_uri)
-                if not conn:
-                    logger.warning(f"Failed to connect to libvirt on server {server.name}")
-                    continue
-                
-                vm_manager = LibvirtManager(ip_manager=self.ip_manager)
-                vm_manager.conn = conn
+                vm_manager = self._get_vm_manager(server)
                 
                 server_vms = vm_manager.list_vms()
                 
@@ -228,7 +222,7 @@ class ClusterVMManager:
                 raise ClusterVMError(f"Destination server {destination_server.name} does not have enough resources")
             
             dest_uri = destination_server.get_libvirt_uri()
-            dest_conn = libvirt.open(dest_uri)
+            dest_conn = get_shared_libvirt_connection(dest_uri)
             if not dest_conn:
                 raise ClusterVMError(f"Failed to connect to libvirt on destination server {destination_server.name}")
             
@@ -244,23 +238,20 @@ class ClusterVMManager:
                     domain.migrate(dest_conn, flags, None, None, 0)
                 else:
                     logger.info(f"Shutting down VM {vm.name} for migration")
-                    domain.shutdown()
-                    
-                    for _ in range(30):
-                        if not domain.isActive():
-                            break
-                        time.sleep(1)
-                    
-                    if domain.isActive():
+                    if not source_vm_manager.shutdown_vm(vm, timeout=30):
                         logger.warning(f"VM {vm.name} did not shut down gracefully, forcing off")
                         domain.destroy()
-                        
-                        logger.info(f"Starting cold migration of VM {vm.name} to server {destination_server.name}")
-                        flags = libvirt.VIR_MIGRATE_PERSIST_DEST | libvirt.VIR_MIGRATE_UNDEFINE_SOURCE
-                        domain.migrate(dest_conn, flags, None, None, 0)
+                    
+                    # The domain is shut off now, and libvirt refuses to
+                    # migrate an inactive domain without VIR_MIGRATE_OFFLINE
+                    logger.info(f"Starting cold migration of VM {vm.name} to server {destination_server.name}")
+                    flags = (libvirt.VIR_MIGRATE_OFFLINE | libvirt.VIR_MIGRATE_PERSIST_DEST |
+                             libvirt.VIR_MIGRATE_UNDEFINE_SOURCE)
+                    domain.migrate(dest_conn, flags, None, None, 0)
             else:
                 logger.info(f"Starting offline migration of VM {vm.name} to server {destination_server.name}")
-                flags = libvirt.VIR_MIGRATE_PERSIST_DEST | libvirt.VIR_MIGRATE_UNDEFINE_SOURCE
+                flags = (libvirt.VIR_MIGRATE_OFFLINE | libvirt.VIR_MIGRATE_PERSIST_DEST |
+                         libvirt.VIR_MIGRATE_UNDEFINE_SOURCE)
                 domain.migrate(dest_conn, flags, None, None, 0)
             
             self.vm_servers[vm_id] = destination_server_id
@@ -302,13 +293,7 @@ class ClusterVMManager:
         server = online_servers[0]
         
         try:
-            libvirt_uri = server.get_libvirt_uri()
-            conn = libvirt.open(libvirt_uri)
-            if not conn:
-                raise ClusterVMError(f"Failed to connect to libvirt on server {server.name}")
-            
-            vm_manager = LibvirtManager(ip_manager=self.ip_manager)
-            vm_manager.conn = conn
+            vm_manager = self._get_vm_manager(server)
             
             return vm_manager.create_disk(name, size_gb)
         except Exception as e:
@@ -324,14 +309,7 @@ class ClusterVMManager:
                 continue
             
             try:
-                libvirt_uri = server.get_libvirt_uri()
-                conn = libvirt.open(libvirt_uri)
-                if not conn:
-                    logger.warning(f"Failed to connect to libvirt on server {server.name}")
-                    continue
-                
-                vm_manager = LibvirtManager(ip_manager=self.ip_manager)
-                vm_manager.conn = conn
+                vm_manager = self._get_vm_manager(server)
                 
                 server_disks = vm_manager.list_disks()
                 all_disks.extend(server_disks)
@@ -1,5 +1,6 @@
 import sqlite3
 import json
+import orjson
 import logging
 from pathlib import Path
 from typing import Dict, List, Optional, Any
@@ -8,6 +9,10 @@ import time
 
 logger = logging.getLogger(__name__)
 
+# VMConfig fields stored in the vms.config JSON column (name has its own column)
+VM_CONFIG_FIELDS = ('cpu_cores', 'memory_mb', 'disk_size_gb', 'network_name',
+                    'cloud_init', 'image_id', 'arch', 'disk_cache')
+
 class DatabaseError(Exception):
     """Custom exception for database operations"""
     pass
@@ -154,15 +159,8 @@ class Database:
             """, (
                 vm_id,
                 data['name'],
-                json.dumps({
-                    'cpu_cores': data['cpu_cores'],
-                    'memory_mb': data['memory_mb'],
-                    'disk_size_gb': data['disk_size_gb'],
-                    'network_name': data['network_name'],
-                    'cloud_init': data.get('cloud_init'),
-                    'image_id': data.get('image_id')
-                }),
-                json.dumps(data.get('network_info')),
+                orjson.dumps({key: data.get(key) for key in VM_CONFIG_FIELDS}).decode(),
+                orjson.dumps(data.get('network_info')).decode(),
                 data.get('ssh_port'),
                 data.get('status', 'creating'),
                 data.get('created_at', now),
@@ -298,19 +296,19 @@ class Database:
             if row:
                 return {
                     **dict(row),
-                    'config': json.loads(row['config']),
-                    'network_info': json.loads(row['network_info']) if row['network_info'] else None
+                    'config': orjson.loads(row['config']),
+                    'network_info': orjson.loads(row['network_info']) if row['network_info'] else None
                 }
         return None
 
     def list_vms(self) -> List[Dict]:
         with self.get_connection() as conn:
-            cursor = conn.execute("SELECT * FROM vms")
+            cursor = conn.execute("SELECT * FROM vms ORDER BY created_at")
             return [
                 {
                     **dict(row),
-                    'config': json.loads(row['config']),
-                    'network_info': json.loads(row['network_info']) if row['network_info'] else None
+                    'config': orjson.loads(row['config']),
+                    'network_info': orjson.loads(row['network_info']) if row['network_info'] else None
                 }
                 for row in cursor.fetchall()
             ]
@@ -371,6 +369,21 @@ class Database:
                 ip
             ))
 
+    def claim_ip(self, machine_id: str, is_elastic: bool = False) -> Optional[str]:
+        """Atomically attach the first available IP to a machine and return it.
+
+        Selecting and updating in one statement means concurrent callers can
+        never be handed the same address. Returns None if the pool is empty.
+        """
+        with self.get_connection() as conn:
+            row = conn.execute("""
+            UPDATE ip_addresses
+            SET state = 'attached', machine_id = ?, is_elastic = ?, updated_at = ?
+            WHERE ip = (SELECT ip FROM ip_addresses WHERE state = 'available' ORDER BY rowid LIMIT 1)
+            RETURNING ip
+            """, (machine_id, is_elastic, time.time())).fetchone()
+            return row['ip'] if row else None
+
     def delete_ip(self, ip: str) -> None:
         """Delete an IP address entry"""
         with self.get_connection() as conn:
@@ -388,20 +401,13 @@ class Database:
                 params.append(data['name'])
             
             if 'config' in data:
-                config = {
-                    'cpu_cores': data['config'].get('cpu_cores'),
-                    'memory_mb': data['config'].get('memory_mb'),
-                    'disk_size_gb': data['config'].get('disk_size_gb'),
-                    'network_name': data['config'].get('network_name'),
-                    'cloud_init': data['config'].get('cloud_init'),
-                    'image_id': data['config'].get('image_id')
-                }
+                config = {key: data['config'].get(key) for key in VM_CONFIG_FIELDS}
                 update_fields.append("config = ?")
-                params.append(json.dumps(config))
+                params.append(orjson.dumps(config).decode())
             
             if 'network_info' in data:
                 update_fields.append("network_info = ?")
-                params.append(json.dumps(data['network_info']))
+                params.append(orjson.dumps(data['network_info']).decode())
             
             if 'ssh_port' in data:
                 update_fields.append("ssh_port = ?")
@@ -425,6 +431,14 @@ class Database:
             query = f"UPDATE vms SET {', '.join(update_fields)} WHERE id = ?"
             conn.execute(query, params)
 
+    def update_vm_state(self, vm_id: str, status: str, error_message: Optional[str] = None) -> None:
+        """Update only a VM's status columns, without rewriting its config."""
+        with self.get_connection() as conn:
+            conn.execute(
+                "UPDATE vms SET status = ?, error_message = ?, updated_at = ? WHERE id = ?",
+                (status, error_message, time.time(), vm_id)
+            )
+
     # Disk management methods
     def create_disk(self, disk_id: str, data: Dict) -> None:
         with self.get_connection() as conn:
@@ -1,14 +1,39 @@
 import uuid
 import json
+import threading
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional
 import libvirt
 import logging
+try:
+    # C-backed parser for domain XML
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
 from dataclasses import dataclass, asdict
 from .db import db
 
 logger = logging.getLogger(__name__)
 
+# ElementTree paths into domain XML
+XPATH_DISKS = './/disk[@device="disk"]'
+
+def disk_device_xml(source_file: str, dev: str, bus: str = 'virtio', device: str = 'disk',
+                    driver_type: Optional[str] = 'qcow2', readonly: bool = False,
+                    cache: Optional[str] = None) -> str:
+    """Build the <disk> device XML for attachDevice/detachDevice, escaping all values."""
+    # Fixed shape, so format it directly rather than building an element tree
+    driver = ''
+    if driver_type:
+        cache_attr = f" cache={quoteattr(cache)}" if cache else ''
+        driver = f"<driver name='qemu' type={quoteattr(driver_type)}{cache_attr}/>"
+    return (f"<disk type='file' device={quoteattr(device)}>{driver}"
+            f"<source file={quoteattr(str(source_file))}/>"
+            f"<target dev={quoteattr(dev)} bus={quoteattr(bus)}/>"
+            f"{'<readonly/>' if readonly else ''}</disk>")
+
 @dataclass
 class Disk:
     id: str
@@ -22,23 +47,69 @@ class Disk:
 class DiskManager:
     def __init__(self, conn: libvirt.virConnect):
         self.conn = conn
+        # Attached disks per VM as {target dev: source file}, kept in step
+        # with attach/detach so the domain XML is only parsed once per VM
+        self._disk_targets_cache: Dict[str, Dict[str, str]] = {}
+        # Attach/detach on the same VM are serialized so concurrent callers
+        # can't pick the same target dev or race on the cached layout
+        self._vm_locks: Dict[str, threading.Lock] = {}
+        self._vm_locks_guard = threading.Lock()
+        # Default pool handle and the connection it belongs to
+        self._pool: Optional[libvirt.virStoragePool] = None
+        self._pool_conn: Optional[libvirt.virConnect] = None
+
+    def _get_pool(self) -> libvirt.virStoragePool:
+        """Return the default storage pool, looking it up once per connection."""
+        if self._pool is None or self._pool_conn is not self.conn:
+            self._pool = self.conn.storagePoolLookupByName('default')
+            self._pool_conn = self.conn
+        return self._pool
+
+    def _get_disk_targets(self, domain: libvirt.virDomain, vm_id: str) -> Dict[str, str]:
+        """Map each disk target dev of a VM to its source file."""
+        targets = self._disk_targets_cache.get(vm_id)
+        if targets is None:
+            root = ET.fromstring(domain.XMLDesc())
+            targets = {}
+            for disk in root.iterfind(XPATH_DISKS):
+                # One pass over each disk's children instead of a find() per field
+                dev = source_file = None
+                for child in disk:
+                    if child.tag == 'target':
+                        dev = child.get('dev')
+                    elif child.tag == 'source':
+                        source_file = child.get('file')
+                if dev:
+                    targets[dev] = source_file
+            self._disk_targets_cache[vm_id] = targets
+        return targets
+
+    def invalidate_disk_targets(self, vm_id: str) -> None:
+        """Forget the cached disk layout of a VM."""
+        self._disk_targets_cache.pop(vm_id, None)
 
     def create_disk(self, name: str, size_gb: int) -> Disk:
         disk_id = str(uuid.uuid4())[:8]
         disk = Disk(disk_id, name, size_gb)
         
         # Create the disk file
-        pool = self.conn.storagePoolLookupByName('default')
+        pool = self._get_pool()
         vol_xml = f"""<volume type='file'>
             <name>{disk_id}.qcow2</name>
             <capacity unit='G'>{size_gb}</capacity>
             <target>
                 <format type='qcow2'/>
+                <compat>1.1</compat>
+                <features>
+                    <lazy_refcounts/>
+                </features>
             </target>
         </volume>"""
         
         try:
-            volume = pool.createXML(vol_xml, 0)
+            # Preallocating the qcow2 metadata avoids refcount/L2 table
+            # allocation on the guest's first writes
+            volume = pool.createXML(vol_xml, libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA)
             if not volume:
                 raise Exception("Failed to create disk volume")
             
@@ -65,7 +136,7 @@ class DiskManager:
         
         # Delete the disk file
         try:
-            pool = self.conn.storagePoolLookupByName('default')
+            pool = self._get_pool()
             volume = pool.storageVolLookupByName(f"{disk_id}.qcow2")
             volume.delete(0)
         except libvirt.libvirtError as e:
@@ -74,96 +145,104 @@ class DiskManager:
         db.delete_disk(disk_id)
 
     def attach_disk(self, disk_id: str, vm_id: str) -> None:
-        disk_data = db.get_disk(disk_id)
-        if not disk_data:
-            raise ValueError(f"Disk {disk_id} not found")
-        
-        if disk_data.get('attached_to'):
-            raise ValueError(f"Disk {disk_id} is already attached to a machine")
+        self.attach_disks([disk_id], vm_id)
+
+    def _vm_lock(self, vm_id: str) -> threading.Lock:
+        """Lock serializing attach/detach on one VM, created on first use."""
+        with self._vm_locks_guard:
+            return self._vm_locks.setdefault(vm_id, threading.Lock())
+
+    def attach_disks(self, disk_ids: List[str], vm_id: str) -> None:
+        """Attach several disks to one VM with a single domain lookup and layout read."""
+        for disk_id in disk_ids:
+            disk_data = db.get_disk(disk_id)
+            if not disk_data:
+                raise ValueError(f"Disk {disk_id} not found")
+            
+            if disk_data.get('attached_to'):
+                raise ValueError(f"Disk {disk_id} is already attached to a machine")
         
-        try:
-            # Get VM domain using the VM ID
-            domain = None
+        with self._vm_lock(vm_id):
             try:
-                domain = self.conn.lookupByName(vm_id)
-            except libvirt.libvirtError:
-                logger.error(f"Could not find VM domain for {vm_id}")
-                raise ValueError(f"VM {vm_id} not found")
+                # Get VM domain using the VM ID
+                domain = None
+                try:
+                    domain = self.conn.lookupByName(vm_id)
+                except libvirt.libvirtError:
+                    logger.error(f"Could not find VM domain for {vm_id}")
+                    raise ValueError(f"VM {vm_id} not found")
 
-            pool = self.conn.storagePoolLookupByName('default')
-            volume = pool.storageVolLookupByName(f"{disk_id}.qcow2")
-            
-            # Find next available device name
-            xml = domain.XMLDesc()
-            import xml.etree.ElementTree as ET
-            root = ET.fromstring(xml)
-            existing_disks = root.findall('.//disk[@device="disk"]/target')
-            used_devs = {disk.get('dev') for disk in existing_disks}
-            
-            # Generate device name (vdb, vdc, etc.)
-            for c in 'bcdefghijklmnopqrstuvwxyz':
-                dev = f'vd{c}'
-                if dev not in used_devs:
-                    break
-            else:
-                raise Exception("No available device names")
-            
-            # Attach disk
-            disk_xml = f"""
-            <disk type='file' device='disk'>
-                <driver name='qemu' type='qcow2'/>
-                <source file='{volume.path()}'/>
-                <target dev='{dev}' bus='virtio'/>
-            </disk>
-            """
-            
-            domain.attachDevice(disk_xml)
-            
-            # Update database
-            db.update_disk(disk_id, {
-                'attached_to': vm_id,
-                'state': 'attached'
-            })
-            
-        except libvirt.libvirtError as e:
-            logger.error(f"Failed to attach disk: {e}")
-            raise Exception(f"Failed to attach disk: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error attaching disk: {e}")
-            raise
+                pool = self._get_pool()
+                
+                # Device names (vdb, vdc, etc.) not yet used by the VM
+                used_devs = self._get_disk_targets(domain, vm_id)
+                free_devs = (f'vd{c}' for c in 'bcdefghijklmnopqrstuvwxyz' if f'vd{c}' not in used_devs)
+                
+                for disk_id in disk_ids:
+                    volume = pool.storageVolLookupByName(f"{disk_id}.qcow2")
+                    dev = next(free_devs, None)
+                    if dev is None:
+                        raise Exception("No available device names")
+                    
+                    # Attach disk
+                    domain.attachDevice(disk_device_xml(volume.path(), dev))
+                    used_devs[dev] = volume.path()
+                    
+                    # Update database
+                    db.update_disk(disk_id, {
+                        'attached_to': vm_id,
+                        'state': 'attached'
+                    })
+                
+            except libvirt.libvirtError as e:
+                self.invalidate_disk_targets(vm_id)
+                logger.error(f"Failed to attach disk: {e}")
+                raise Exception(f"Failed to attach disk: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected error attaching disk: {e}")
+                raise
 
     def detach_disk(self, disk_id: str) -> None:
-        disk_data = db.get_disk(disk_id)
-        if not disk_data:
-            raise ValueError(f"Disk {disk_id} not found")
-        
-        if not disk_data['attached_to']:
-            raise ValueError(f"Disk {disk_id} is not attached to any machine")
-        
-        try:
-            domain = self.conn.lookupByName(disk_data['attached_to'])
-            pool = self.conn.storagePoolLookupByName('default')
-            volume = pool.storageVolLookupByName(f"{disk_id}.qcow2")
-            
-            # Find the disk in domain XML
-            xml = domain.XMLDesc()
-            import xml.etree.ElementTree as ET
-            root = ET.fromstring(xml)
-            for disk in root.findall('.//disk[@device="disk"]'):
-                source = disk.find('source')
-                if source is not None and source.get('file') == volume.path():
-                    disk_xml = ET.tostring(disk, encoding='unicode')
-                    domain.detachDevice(disk_xml)
-                    break
-            
-            # Update database
-            db.update_disk(disk_id, {
-                'attached_to': None,
-                'state': 'available'
-            })
+        self.detach_disks([disk_id])
+
+    def detach_disks(self, disk_ids: List[str]) -> None:
+        """Detach disks, handling all disks of the same VM under one domain lookup."""
+        by_vm: Dict[str, List[str]] = defaultdict(list)
+        for disk_id in disk_ids:
+            disk_data = db.get_disk(disk_id)
+            if not disk_data:
+                raise ValueError(f"Disk {disk_id} not found")
             
-        except libvirt.libvirtError as e:
-            raise Exception(f"Failed to detach disk: {e}")
+            if not disk_data['attached_to']:
+                raise ValueError(f"Disk {disk_id} is not attached to any machine")
+            by_vm[disk_data['attached_to']].append(disk_id)
+        
+        pool = self._get_pool()
+        for vm_id, vm_disk_ids in by_vm.items():
+            with self._vm_lock(vm_id):
+                try:
+                    domain = self.conn.lookupByName(vm_id)
+                    targets = self._get_disk_targets(domain, vm_id)
+                    
+                    for disk_id in vm_disk_ids:
+                        volume = pool.storageVolLookupByName(f"{disk_id}.qcow2")
+                        
+                        # Find the disk in domain XML
+                        for dev, source_file in list(targets.items()):
+                            if source_file == volume.path():
+                                domain.detachDevice(disk_device_xml(source_file, dev, driver_type=None))
+                                del targets[dev]
+                                break
+                        
+                        # Update database
+                        db.update_disk(disk_id, {
+                            'attached_to': None,
+                            'state': 'available'
+                        })
+                    
+                except libvirt.libvirtError as e:
+                    self.invalidate_disk_targets(vm_id)
+                    raise Exception(f"Failed to detach disk: {e}")
 
     def list_disks(self) -> List[Dict]:
         return db.list_disks()
@@ -188,7 +267,7 @@ class DiskManager:
             raise ValueError(f"Cannot resize attached disk {disk_id}")
         
         try:
-            pool = self.conn.storagePoolLookupByName('default')
+            pool = self._get_pool()
             volume = pool.storageVolLookupByName(f"{disk_id}.qcow2")
             volume.resize(new_size_gb * 1024 * 1024 * 1024)
             
@@ -303,6 +303,15 @@ class IPManager:
         available = [ip for ip in ips if ip.get('state') == 'available']
         return random.choice(available)['ip'] if available else None
 
+    def reserve_ip(self, machine_id: str, is_elastic: bool = False) -> Optional[str]:
+        """Attach an available IP to a machine in one step and return it.
+
+        Unlike get_available_ip followed by attach_ip, this is safe when
+        several VMs are created at once.
+        """
+        self._check_pool_utilization()
+        return db.claim_ip(machine_id, is_elastic)
+
     def attach_ip(self, ip: str, machine_id: str, is_elastic: bool = False) -> None:
         """Attach an IP to a machine"""
         ip_data = db.get_ip(ip)
@@ -1,15 +1,62 @@
 import libvirt
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
-def get_libvirt_connection():
+_event_loop_lock = threading.Lock()
+_event_loop_started = False
+
+# Seconds between keepalive probes, and how many may go unanswered before
+# libvirt closes a dead connection
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+# Hypervisor on this host
+LOCAL_URI = 'qemu:///system'
+
+# Connections shared by every manager in the process, keyed by URI
+_shared_conn_lock = threading.Lock()
+_shared_conns = {}
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+def start_event_loop():
+    """Register libvirt's default event implementation and run it in a daemon thread.
+
+    Must happen before a connection is opened for that connection to deliver
+    domain events (e.g. lifecycle callbacks).
+    """
+    global _event_loop_started
+    with _event_loop_lock:
+        if _event_loop_started:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+        threading.Thread(target=_run_event_loop, name='libvirt-events', daemon=True).start()
+        _event_loop_started = True
+
+def get_libvirt_connection(uri: str = LOCAL_URI):
     """Initialize and return a libvirt connection."""
     try:
-        conn = libvirt.open('qemu:///system')
+        start_event_loop()
+        conn = libvirt.open(uri)
         if conn is None:
-            raise Exception('Failed to connect to QEMU/KVM')
+            raise Exception(f'Failed to connect to {uri}')
+        try:
+            conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+        except libvirt.libvirtError as e:
+            logger.debug(f"Keepalive not supported on this connection: {e}")
         return conn
     except libvirt.libvirtError as e:
         logger.error(f"Fai  led to connect to libvirt: {e}")
-        raise Exception(f"Failed to connect to libvirt: {e}") 
\ No newline at end of file
+        raise Exception(f"Failed to connect to libvirt: {e}") 
+
+def get_shared_libvirt_connection(uri: str = LOCAL_URI):
+    """Return the process-wide connection to uri, reopening it if it has dropped."""
+    with _shared_conn_lock:
+        conn = _shared_conns.get(uri)
+        if conn is None or not conn.isAlive():
+            conn = _shared_conns[uri] = get_libvirt_connection(uri)
+        return conn
@@ -8,7 +8,11 @@ import random
 from enum import Enum
 import libvirt
 import logging
-import xml.etree.ElementTree as ET
+try:
+    # C-backed parser for network XML
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
@@ -46,6 +50,10 @@ class NetworkManager:
     def _load_networks(self):
         """Load existing networks from libvirt."""
         try:
+            # Two filtered listings give every network's active/persistent
+            # state up front, instead of isActive()/isPersistent() RPCs each
+            active = {net.name() for net in self.conn.listAllNetworks(libvirt.VIR_CONNECT_LIST_NETWORKS_ACTIVE)}
+            persistent = {net.name() for net in self.conn.listAllNetworks(libvirt.VIR_CONNECT_LIST_NETWORKS_PERSISTENT)}
             for net in self.conn.listAllNetworks():
                 name = net.name()
                 xml = net.XMLDesc()
@@ -75,8 +83,8 @@ class NetworkManager:
                     'type': net_type,
                     'bridge': bridge_name,
                     'subnet': subnet,
-                    'active': net.isActive(),
-                    'persistent': net.isPersistent()
+                    'active': name in active,
+                    'persistent': name in persistent
                 }
         except libvirt.libvirtError as e:
             logger.error(f"Failed to load networks: {e}")
@@ -4,35 +4,350 @@ import subprocess
 import shutil
 import time
 import json
+import copy
+import orjson
 import logging
 import ipaddress
 import requests
+import urllib3
+from urllib3.util import Retry
 import uuid
 import socket
+import hashlib
+import struct
+import ctypes
+import ctypes.util
+import fcntl
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable, Set
 from dataclasses import dataclass, asdict, field
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, Future
 import libvirt
-import xml.etree.ElementTree as ET
+try:
+    # C-backed parser for domain/network XML
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
 from .networking import NetworkManager, NetworkType
 from .ip_manager import IPManager
-from .disk_manager import DiskManager
+from .disk_manager import DiskManager, disk_device_xml
+from .cloud_config import merge_cloud_init
 from datetime import datetime
-from bs4 import BeautifulSoup
 import re
 import traceback
-from .db import db
+from .db import db, VM_CONFIG_FIELDS
 import random
 import string
 import platform
 import threading
-from .libvirt_utils import get_libvirt_connection
+from .libvirt_utils import get_shared_libvirt_connection, LOCAL_URI
 import psutil
+import pycdlib
+from io import BytesIO
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Stat groups get_metrics fetches with one domainListGetStats call
+METRICS_STATS = (libvirt.VIR_DOMAIN_STATS_CPU_TOTAL | libvirt.VIR_DOMAIN_STATS_BALLOON |
+                 libvirt.VIR_DOMAIN_STATS_BLOCK | libvirt.VIR_DOMAIN_STATS_INTERFACE)
+
+# Names reported for libvirt domain states, indexed by state code
+DOMAIN_STATE_NAMES = (
+    'no_state',   # VIR_DOMAIN_NOSTATE
+    'running',    # VIR_DOMAIN_RUNNING
+    'blocked',    # VIR_DOMAIN_BLOCKED
+    'paused',     # VIR_DOMAIN_PAUSED
+    'shutdown',   # VIR_DOMAIN_SHUTDOWN
+    'shutoff',    # VIR_DOMAIN_SHUTOFF
+    'crashed',    # VIR_DOMAIN_CRASHED
+    'suspended',  # VIR_DOMAIN_PMSUSPENDED
+)
+
+
+def domain_state_name(state: Optional[int]) -> str:
+    """Name of a libvirt domain state code, or 'unknown' if it isn't one."""
+    if state is not None and 0 <= state < len(DOMAIN_STATE_NAMES):
+        return DOMAIN_STATE_NAMES[state]
+    return 'unknown'
+
+
+# Host page cache modes accepted for VM disks. 'none' (the default) is safe
+# for persistent VMs; 'unsafe' ignores guest flushes and suits throwaway VMs
+DISK_CACHE_MODES = ('none', 'directsync', 'writeback', 'writethrough', 'unsafe')
+
+# Target device of the root disk in the generated domain XML
+ROOT_DISK_TARGET = 'vda'
+
+# libvirt domain definition used for every VM; see _generate_domain_xml.
+# Indentation between tags is stripped once here so the XML sent to
+# libvirtd carries no whitespace-only text nodes
+DOMAIN_XML_TEMPLATE = re.sub(r'>\s+<', '><', """<domain type='kvm'>
+  <name>{name}</name>
+  <uuid>{uuid}</uuid>
+  <memory unit='MiB'>{memory_mb}</memory>
+  <currentMemory unit='MiB'>{memory_mb}</currentMemory>
+  <vcpu>{cpu_cores}</vcpu>
+  <iothreads>1</iothreads>
+  <os>
+    <type arch='x86_64' machine='q35'>hvm</type>
+    <boot dev='hd'/>
+  </os>
+  <features>
+    <acpi/>
+    <apic/>
+  </features>
+  <cpu mode='host-model'/>
+  <seclabel type='none'/>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='{disk_format}' cache='{disk_cache}' io='{disk_io}' discard='unmap' detect_zeroes='unmap' queues='{cpu_cores}' iothread='1'/>
+      <source file={disk_path}/>
+      <target dev='{root_disk_target}' bus='virtio'/>
+    </disk>
+    <interface type='bridge'>
+      <source bridge={bridge_name}/>{mac_element}
+      <model type='virtio'/>
+    </interface>
+    <console type='pty'>
+      <target type='serial' port='0'/>
+    </console>
+    <graphics type='vnc' port='-1' autoport='yes' listen='0.0.0.0'>
+      <listen type='address' address='0.0.0.0'/>
+    </graphics>
+    <channel type='unix'>
+      <source mode='bind'/>
+      <target type='virtio' name='org.qemu.guest_agent.0'/>
+    </channel>
+    <video>
+      <model type='cirrus'/>
+    </video>
+  </devices>
+</domain>""")
+
+# Base cloud-init user-data for new VMs; the hostname is added per VM
+DEFAULT_CLOUD_INIT = {
+    'users': [{
+        'name': 'ubuntu',
+        'sudo': 'ALL=(ALL) NOPASSWD:ALL',
+        'shell': '/bin/bash',
+        'ssh_authorized_keys': []
+    }],
+    'packages': [
+        'qemu-guest-agent',
+        'python3',
+        'python3-pip',
+        'python3-venv',
+        'build-essential',
+        'pkg-config',
+        'libvirt-dev'
+    ],
+    'package_update': True,
+    'package_upgrade': True,
+    'runcmd': [
+        'systemctl daemon-reload',
+        'systemctl enable qemu-guest-agent',
+        'systemctl start qemu-guest-agent',
+        'systemctl enable ssh',
+        'systemctl start ssh',
+        'netplan apply',
+        'echo "ubuntu:ubuntu" | chpasswd',
+        'apt-get update',
+        'apt-get install -y python3-pip python3-venv libvirt-dev pkg-config',
+        'mkdir -p /opt/api',
+        'chown -R ubuntu:ubuntu /opt/api'
+    ],
+    'power_state': {
+        'mode': 'reboot',
+        'timeout': 30,
+        'condition': True
+    },
+    'final_message': "Cloud-init has completed. The system is ready to use."
+}
+
+# meta-data and network-config for VMs built by _create_cloud_init_config
+DEFAULT_META_DATA_TEMPLATE = """instance-id: {instance_id}
+local-hostname: {hostname}
+network:
+  version: 2
+  ethernets:
+    enp0s1:
+      dhcp4: true
+      dhcp6: false
+"""
+DEFAULT_NETWORK_CONFIG = b"""version: 2
+ethernets:
+    enp0s1:
+        dhcp4: true
+        dhcp4-overrides:
+            use-dns: true
+            use-ntp: true
+        dhcp6: false
+        optional: true
+"""
+
+# Defaults that user-supplied cloud-init is merged over in
+# _prepare_cloud_init_config, with the matching meta-data and network-config
+MINIMAL_CLOUD_INIT = {
+    'users': [{
+        'name': 'ubuntu',
+        'shell': '/bin/bash',
+        'sudo': 'ALL=(ALL) NOPASSWD:ALL',
+        'ssh_authorized_keys': []
+    }],
+    'packages': ['qemu-guest-agent', 'cloud-init'],
+    'package_update': True,
+    'package_upgrade': True,
+    'runcmd': ['systemctl enable qemu-guest-agent', 'systemctl start qemu-guest-agent'],
+    'write_files': []
+}
+MINIMAL_META_DATA_TEMPLATE = """instance-id: {instance_id}
+local-hostname: {hostname}
+"""
+MINIMAL_NETWORK_CONFIG = b"""version: 2
+ethernets:
+  ens3:
+    dhcp4: true
+"""
+
+# user-data is YAML; compact JSON is valid YAML, so it is written without
+# pretty-printing after this header
+CLOUD_CONFIG_HEADER = b"#cloud-config\n"
+
+# DEFAULT_CLOUD_INIT serialized once, without its opening brace, so VMs with
+# no custom cloud-init only need their hostname spliced in front
+DEFAULT_CLOUD_INIT_JSON_TAIL = orjson.dumps(DEFAULT_CLOUD_INIT)[1:]
+
+# Default storage pool, defined by _init_storage_pool when libvirt has none
+POOL_XML_TEMPLATE = """<pool type='dir'>
+  <name>default</name>
+  <target>
+    <path>{path}</path>
+    <permissions>
+      <mode>0755</mode>
+      <owner>64055</owner>
+      <group>64055</group>
+    </permissions>
+  </target>
+</pool>"""
+
+# Storage volume for a VM root disk: a qcow2 overlay on the cloud image
+VOLUME_XML_TEMPLATE = """<volume type='file'>
+  <name>{name}</name>
+  <capacity unit='G'>{size_gb}</capacity>
+  <target>
+    <format type='qcow2'/>
+    <compat>1.1</compat>
+    <features>
+      <lazy_refcounts/>
+    </features>{nocow_element}
+  </target>
+  <backingStore>
+    <path>{backing_path}</path>
+    <format type='{backing_format}'/>
+  </backingStore>
+</volume>"""
+
+# statfs f_type magic for Btrfs, where qcow2 files should be created NOCOW
+BTRFS_SUPER_MAGIC = 0x9123683E
+
+# ioctl that clones a whole file as a reflink (Btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+# 52:54:00 is the locally administered prefix libvirt uses for guest NICs
+QEMU_MAC_PREFIX = 0x525400 << 24
+
+# First bytes of every qcow2 image
+QCOW2_MAGIC = b'QFI\xfb'
+
+# Leading qcow2 header fields: magic, version, backing file offset/size,
+# cluster bits, virtual size
+QCOW2_HEADER = struct.Struct('>4sIQIIQ')
+
+# Buffer size used when streaming cloud images to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Read size used when hashing downloaded images
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Download progress is logged each time this fraction of the image arrives
+DOWNLOAD_PROGRESS_STEP = 0.1
+
+# Images at least this large are fetched over several ranged connections
+PARALLEL_DOWNLOAD_MIN_SIZE = 64 * 1024 * 1024
+DOWNLOAD_CONNECTIONS = 8
+
+# Kept-alive connections per host in the download session's pool; ranged
+# downloads for several images can be in flight at once
+HTTP_POOL_MAXSIZE = 16
+# Retries for failed connections and transient error statuses, with
+# exponential backoff starting at HTTP_RETRY_BACKOFF seconds
+HTTP_MAX_RETRIES = 5
+HTTP_RETRY_BACKOFF = 1
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Times a single-stream download is resumed after the connection drops
+DOWNLOAD_RESUME_ATTEMPTS = 3
+
+# Downloadable base images by image ID - add more as needed
+CLOUD_IMAGE_URLS = {
+    'ubuntu-20.04': 'https://cloud-images.ubuntu.com/releases/focal/release/ubuntu-20.04-server-cloudimg-amd64.img',
+    'ubuntu-22.04': 'https://cloud-images.ubuntu.com/releases/jammy/release/ubuntu-22.04-server-cloudimg-amd64.img',
+    'debian-11': 'https://cloud.debian.org/images/cloud/bullseye/latest/debian-11-generic-amd64.qcow2',
+    'debian-12': 'https://cloud.debian.org/images/cloud/bookworm/latest/debian-12-generic-amd64.qcow2',
+    'centos-9-stream': 'https://cloud.centos.org/centos/9-stream/x86_64/images/CentOS-Stream-GenericCloud-9-latest.x86_64.qcow2',
+    'alpine-3.17': 'https://dl-cdn.alpinelinux.org/alpine/v3.17/releases/x86_64/alpine-virt-3.17.0-x86_64.iso',
+}
+
+# Images prepared in the background when the API starts, so the first VM
+# created from them doesn't wait on a download
+WARM_IMAGE_IDS = ('ubuntu-22.04',)
+
+# Links to Ubuntu cloud images for one architecture on a directory index page,
+# capturing the href and the release, e.g.
+# href="ubuntu-20.04-server-cloudimg-amd64.img"; compiled per host arch
+UBUNTU_IMAGE_HREF_PATTERN = rb'href="([^"]*?ubuntu-(\d+\.\d+)[^"]*-%s\.img)"'
+
+# Ubuntu's name for each platform.machine() value
+UBUNTU_ARCH_NAMES = {'x86_64': 'amd64', 'aarch64': 'arm64', 'arm64': 'arm64'}
+
+# Seconds list_images serves its in-memory result before checking again
+IMAGE_LIST_TTL = 300
+# Seconds list_images serves DEFAULT_IMAGE_LIST after a failed fetch, so an
+# outage doesn't turn every call into another request
+IMAGE_LIST_ERROR_TTL = 60
+
+# Returned by list_images when the Ubuntu index can't be fetched or parsed
+DEFAULT_IMAGE_LIST = [
+    {
+        "id": "ubuntu-20.04",
+        "name": "Ubuntu 20.04 LTS",
+        "version": "20.04",
+        "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img"
+    }
+]
+
+# Seconds get_vm_status reuses a domain's state, so back-to-back polls of
+# the same VM don't each cost a libvirt RPC
+VM_STATUS_TTL = 1.0
+
+# SSH forwarding ports handed to VMs, kept below the kernel's ephemeral
+# range (32768+) so they can't collide with outgoing connections
+SSH_PORT_RANGE = range(2222, 32768)
+
+# SSH ports held by VMs, shared by every LibvirtManager in the process so the
+# API's manager and the cluster's per-server ones can't hand out the same one.
+# _next_port is where _find_free_port resumes probing
+_port_lock = threading.Lock()
+_allocated_ports: Set[int] = set()
+_next_port = SSH_PORT_RANGE.start
+
+# Seconds a finished background job is kept for get_job
+JOB_RESULT_TTL = 3600
+
+@dataclass(slots=True)
 class VMConfig:
     name: str
     network_name: str
@@ -42,6 +357,7 @@ class VMConfig:
     image_id: str
     cloud_init: Optional[dict] = None
     arch: Optional[str] = None
+    disk_cache: str = 'none'
 
 class VMStatus:
     CREATING = 'creating'
@@ -55,7 +371,7 @@ class VMError(Exception):
     """Custom exception for VM operations"""
     pass
 
-@dataclass
+@dataclass(slots=True)
 class VMMetrics:
     cpu_usage: float
     memory_usage: float
@@ -63,7 +379,7 @@ class VMMetrics:
     network_usage: Dict[str, Dict[str, int]]
     timestamp: float
 
-@dataclass
+@dataclass(slots=True)
 class VM:
     id: str
     name: str
@@ -101,12 +417,37 @@ class VM:
         self.metrics_history = [m for m in self.metrics_history if m.timestamp > cutoff_time]
 
 class LibvirtManager:
-    def __init__(self, ip_manager: Optional[IPManager] = None):
-        """Initialize the LibvirtManager."""
+    def __init__(self, ip_manager: Optional[IPManager] = None, uri: str = LOCAL_URI):
+        """Initialize the LibvirtManager for the hypervisor at uri."""
         try:
-            self.conn = get_libvirt_connection()
-        if not self.conn:
+            # One connection per URI and process, so the cluster manager's
+            # LibvirtManagers don't each open their own. Everything below
+            # (domain cache, disk manager, storage pool) is built on it
+            self.uri = uri
+            self.conn = get_shared_libvirt_connection(uri)
+            if not self.conn:
                 raise VMError("Failed to establish libvirt connection")
+
+            # Domain handles keyed by VM name, so status polls don't issue a
+            # lookupByName RPC every time
+            self._domain_cache: Dict[str, libvirt.virDomain] = {}
+            # Recent get_vm_status results: VM name -> (monotonic time, state)
+            self._status_cache: Dict[str, Tuple[float, str]] = {}
+
+            # Background jobs for long-running operations, keyed by job id.
+            # Bounded so a burst of requests queues instead of flooding libvirtd
+            self._executor = ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 10))
+            # Image warm-ups get their own worker, so a long download never
+            # holds up queued creates and deletes on a small host
+            self._warm_executor = ThreadPoolExecutor(max_workers=1)
+            self._jobs: Dict[str, Future] = {}
+            # Monotonic finish times of completed jobs, for expiring them
+            self._job_finished_at: Dict[str, float] = {}
+            self._jobs_lock = threading.Lock()
+
+            # Serializes downloads of the same image across concurrent creates
+            self._image_locks: Dict[str, threading.Lock] = {}
+            self._image_locks_guard = threading.Lock()
                 
             self.ip_manager = ip_manager or IPManager()
             
@@ -118,38 +459,80 @@ class LibvirtManager:
                 # If that doesn't exist, fall back to the app directory
                 if not self.vm_dir.exists():
                     logger.warning(f"Symlinked directory {self.vm_dir} not found, falling back to app directory")
-            self.vm_dir = Path("api/data/vms")
+                    self.vm_dir = Path("api/data/vms")
                     
                 # Make sure our VM directory exists
                 if not self.vm_dir.exists():
-            self.vm_dir.mkdir(parents=True, exist_ok=True)
+                    self.vm_dir.mkdir(parents=True, exist_ok=True)
             
                 logger.info(f"Using VM directory: {self.vm_dir}")
             except Exception as e:
                 logger.warning(f"Failed to set up VM directory: {e}, falling back to default")
                 self.vm_dir = Path("api/data/vms")
+
+            # VM directories renamed aside by delete_vm whose removal was cut
+            # short by a restart; finish removing them in the background
+            for trash_dir in self.vm_dir.glob('.*.deleting'):
+                logger.info(f"Removing leftover VM directory {trash_dir}")
+                self._executor.submit(shutil.rmtree, trash_dir, ignore_errors=True)
             
             self.vms = self._load_vms()
+            with _port_lock:
+                _allocated_ports.update(vm.ssh_port for vm in self.vms.values() if vm.ssh_port)
+            # Guards self.vms and VM rows in the database against concurrent
+            # creates/deletes (create_vms, background jobs)
+            self._vms_lock = threading.RLock()
             
             # Initialize disk manager
             self.disk_manager = DiskManager(self.conn)
             
-            # Set up storage pool
-            try:
-                self._init_storage_pool()
-            except Exception as e:
-                logger.warning(f"Could not initialize storage pool: {e}")
+            # Storage pool, set up on first use and kept for later volume calls
+            self._conn_lock = threading.Lock()
+            self._pool_lock = threading.Lock()
+            self._pool: Optional[libvirt.virStoragePool] = None
+            self._pool_path: Optional[Path] = None
+            self._pool_btrfs: Optional[bool] = None
+            # Reflink probe results keyed by (base image dir, VM disk dir)
+            self._reflink_supported: Dict[Tuple[Path, Path], bool] = {}
                 
             # Detect system architecture
             self.arch = platform.machine()
             self.is_arm = 'arm' in self.arch.lower() or 'aarch64' in self.arch.lower()
+            # The index lists every architecture's image for each release;
+            # only this host's can boot, so only match those
+            ubuntu_arch = UBUNTU_ARCH_NAMES.get(self.arch.lower(), 'amd64')
+            self._image_href_re = re.compile(UBUNTU_IMAGE_HREF_PATTERN % re.escape(ubuntu_arch.encode()))
+            
+            # Images are cached by source URL and hard-linked into place, so
+            # image IDs sharing a URL are only ever downloaded once
+            self.image_cache_dir = Path.home() / '.cache' / 'vm-experiments' / 'images'
             
-            # Session for image downloads
+            # Session for image downloads; connections to the image mirrors
+            # are kept alive and reused across index refreshes and downloads
             self.session = requests.Session()
+            retry = Retry(total=HTTP_MAX_RETRIES, backoff_factor=HTTP_RETRY_BACKOFF,
+                          status_forcelist=HTTP_RETRY_STATUSES,
+                          allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
             self.request_timeout = 300  # 5 minutes timeout for large downloads
             
             # Ubuntu image repository
             self.ubuntu_daily_base_url = "https://cloud-images.ubuntu.com/releases/focal/release/"
+            # list_images result and the monotonic time it expires at
+            self._image_list_cache: Optional[Tuple[float, List[Dict[str, str]]]] = None
+            # Conditional request headers (ETag / Last-Modified) for the index
+            # page, and the images parsed from it
+            self._image_index: Optional[Tuple[Dict[str, str], List[Dict[str, str]]]] = None
+            # Parsed SHA256SUMS files keyed by the directory URL they came from
+            self._checksum_cache: Dict[str, Dict[str, str]] = {}
+
+            # IDs of base images already prepared on this host; see
+            # _cached_image_ids
+            self._image_id_set: Optional[Set[str]] = None
+            self._image_available_listeners: List[Callable[[str], None]] = []
             
             logger.info("LibvirtManager initialized successfully")
             
@@ -159,27 +542,124 @@ class LibvirtManager:
 
     def _load_vms(self) -> Dict[str, VM]:
         vms = {}
-        stored_vms = db.list_vms()
-        for vm_data in stored_vms:
+        for vm_data in db.list_vms():
+            # Settings live in the nested config column; rows written before a
+            # field existed simply fall back to the VMConfig default
+            stored_config = vm_data['config']
             config = VMConfig(
                 name=vm_data['name'],
-                cpu_cores=vm_data['cpu_cores'],
-                memory_mb=vm_data['memory_mb'],
-                disk_size_gb=vm_data['disk_size_gb'],
-                network_name=vm_data['network_name'],
-                cloud_init=vm_data.get('cloud_init'),
-                image_id=vm_data.get('image_id')
+                **{key: stored_config[key] for key in VM_CONFIG_FIELDS
+                   if stored_config.get(key) is not None}
             )
             vm = VM(
                 id=vm_data['id'],
                 name=vm_data['name'],
                 config=config,
-                network_info=vm_data.get('network_info'),
-                ssh_port=vm_data.get('ssh_port')
+                network_info=vm_data['network_info'],
+                ssh_port=vm_data['ssh_port'],
+                status=vm_data['status'],
+                created_at=vm_data['created_at'],
+                updated_at=vm_data['updated_at'],
+                error_message=vm_data['error_message']
             )
             vms[vm.id] = vm
         return vms
 
+    def _get_conn(self) -> libvirt.virConnect:
+        """Return the libvirt connection, reopening it if it has dropped."""
+        if self.conn.isAlive():
+            return self.conn
+        with self._conn_lock:
+            if not self.conn.isAlive():
+                logger.warning(f"Libvirt connection to {self.uri} lost, reconnecting")
+                self.conn = get_shared_libvirt_connection(self.uri)
+                self.disk_manager.conn = self.conn
+                # Handles from the old connection are no longer usable
+                self._domain_cache.clear()
+                self._pool = None
+        return self.conn
+
+    def _get_default_pool(self) -> libvirt.virStoragePool:
+        """Return the default storage pool, setting it up on first use."""
+        self._get_conn()
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self._init_storage_pool()
+            return self._pool
+
+    def _get_pool_path(self) -> Path:
+        """Target directory of the default storage pool, read from its XML once."""
+        if self._pool_path is None:
+            pool_root = ET.fromstring(self._get_default_pool().XMLDesc(0))
+            self._pool_path = Path(pool_root.findtext('target/path'))
+        return self._pool_path
+
+    def _pool_is_btrfs(self) -> bool:
+        """Whether the default pool's directory is on Btrfs, checked once."""
+        if self._pool_btrfs is None:
+            self._pool_btrfs = self._get_fs_magic(self._get_pool_path()) == BTRFS_SUPER_MAGIC
+        return self._pool_btrfs
+
+    def _get_fs_magic(self, path: Path) -> Optional[int]:
+        """statfs f_type of the filesystem holding path, or None if unavailable."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            buf = ctypes.create_string_buffer(256)  # larger than struct statfs on any Linux ABI
+            if libc.statfs(str(path).encode(), buf) != 0:
+                return None
+            return ctypes.c_long.from_buffer(buf).value & 0xFFFFFFFF
+        except (OSError, AttributeError) as e:
+            logger.debug(f"Could not statfs {path}: {e}")
+            return None
+
+    def _get_domain(self, vm: VM) -> libvirt.virDomain:
+        """Return the libvirt domain for a VM, reusing a cached handle if present."""
+        conn = self._get_conn()
+        domain = self._domain_cache.get(vm.name)
+        if domain is None:
+            domain = conn.lookupByName(vm.name)
+            self._domain_cache[vm.name] = domain
+        return domain
+
+    def _destroy_domain(self, domain: libvirt.virDomain) -> None:
+        """Force off a domain, treating one that is already stopped as success."""
+        try:
+            domain.destroy()
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_OPERATION_INVALID:
+                raise
+
+    def _invalidate_domain(self, vm_name: str) -> None:
+        """Forget the cached domain handle, status and disk layout for a VM."""
+        self._domain_cache.pop(vm_name, None)
+        self._status_cache.pop(vm_name, None)
+        self.disk_manager.invalidate_disk_targets(vm_name)
+
+    def shutdown_vm(self, vm: VM, timeout: float = 30) -> bool:
+        """Ask the guest to shut down and wait for it to stop.
+
+        Returns True once the domain has stopped, or False if it is still
+        running after timeout seconds.
+        """
+        domain = self._get_domain(vm)
+        stopped = threading.Event()
+
+        def on_lifecycle(conn, dom, event, detail, opaque):
+            if event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+                stopped.set()
+
+        # Register before shutting down so the stop event can't be missed
+        callback_id = self.conn.domainEventRegisterAny(
+            domain, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, on_lifecycle, None)
+        try:
+            domain.shutdown()
+            self._status_cache.pop(vm.name, None)
+            if stopped.wait(timeout):
+                return True
+            return not domain.isActive()
+        finally:
+            self.conn.domainEventDeregisterAny(callback_id)
+
     def _create_cloud_init_config(self, vm: VM) -> None:
         """Create cloud-init configuration for the VM."""
         try:
@@ -188,90 +668,23 @@ class LibvirtManager:
             if not vm_dir.exists():
                 vm_dir.mkdir(parents=True, exist_ok=True)
 
-            # Create default cloud-init configuration
-            default_cloud_init = {
-                'hostname': vm.name,
-                'users': [{
-                    'name': 'ubuntu',
-                    'sudo': 'ALL=(ALL) NOPASSWD:ALL',
-                    'shell': '/bin/bash',
-                    'ssh_authorized_keys': []
-                }],
-                'packages': [
-                    'qemu-guest-agent',
-                    'python3',
-                    'python3-pip',
-                    'python3-venv',
-                    'build-essential',
-                    'pkg-config',
-                    'libvirt-dev'
-                ],
-                'package_update': True,
-                'package_upgrade': True,
-                'runcmd': [
-                    'systemctl daemon-reload',
-                    'systemctl enable qemu-guest-agent',
-                    'systemctl start qemu-guest-agent',
-                    'systemctl enable ssh',
-                    'systemctl start ssh',
-                    'netplan apply',
-                    'echo "ubuntu:ubuntu" | chpasswd',
-                    'apt-get update',
-                    'apt-get install -y python3-pip python3-venv libvirt-dev pkg-config',
-                    'mkdir -p /opt/api',
-                    'chown -R ubuntu:ubuntu /opt/api'
-                ],
-                'power_state': {
-                    'mode': 'reboot',
-                    'timeout': 30,
-                    'condition': True
-                },
-                'final_message': "Cloud-init has completed. The system is ready to use."
-            }
-
+            # Build user-data from the default cloud-init configuration
             if vm.config.cloud_init:
-                self._merge_cloud_init(default_cloud_init, vm.config.cloud_init)
-
-            # Create meta-data
-            meta_data = f"""instance-id: {vm.id}
-local-hostname: {vm.name}
-network:
-  version: 2
-  ethernets:
-    enp0s1:
-      dhcp4: true
-      dhcp6: false
-"""
-            (vm_dir / 'meta-data').write_text(meta_data)
+                cloud_init = {'hostname': vm.name, **copy.deepcopy(DEFAULT_CLOUD_INIT)}
+                merge_cloud_init(cloud_init, vm.config.cloud_init)
+                user_data = CLOUD_CONFIG_HEADER + orjson.dumps(cloud_init)
+            else:
+                user_data = b''.join((CLOUD_CONFIG_HEADER, b'{"hostname":', orjson.dumps(vm.name),
+                                      b',', DEFAULT_CLOUD_INIT_JSON_TAIL))
 
-            # Create user-data
-            user_data = "#cloud-config\n" + json.dumps(default_cloud_init, indent=2)
-            (vm_dir / 'user-data').write_text(user_data)
+            meta_data = DEFAULT_META_DATA_TEMPLATE.format(instance_id=vm.id, hostname=vm.name)
 
-            # Create network-config
-            network_config = """version: 2
-ethernets:
-    enp0s1:
-        dhcp4: true
-        dhcp4-overrides:
-            use-dns: true
-            use-ntp: true
-        dhcp6: false
-        optional: true
-"""
-            (vm_dir / 'network-config').write_text(network_config)
-
-            # Create cloud-init ISO
-            subprocess.run([
-                'mkisofs',
-                '-output', str(vm_dir / "cloud-init.iso"),
-                '-volid', 'cidata',
-                '-joliet',
-                '-rock',
-                str(vm_dir / 'user-data'),
-                str(vm_dir / 'meta-data'),
-                str(vm_dir / 'network-config')
-            ], check=True)
+            # Create cloud-init ISO straight from the in-memory contents
+            self._write_cloud_init_iso(vm_dir / "cloud-init.iso", {
+                'user-data': user_data,
+                'meta-data': meta_data.encode(),
+                'network-config': DEFAULT_NETWORK_CONFIG
+            })
 
             logger.info(f"Created cloud-init configuration for VM {vm.id}")
 
@@ -280,6 +693,21 @@ ethernets:
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise
 
+    def _write_cloud_init_iso(self, iso_path: Path, files: Dict[str, bytes]) -> None:
+        """Build a NoCloud ISO (volume id 'cidata') in-process with pycdlib."""
+        iso = pycdlib.PyCdlib()
+        iso.new(joliet=3, rock_ridge='1.09', vol_ident='cidata')
+        try:
+            for name, data in files.items():
+                # ISO9660 level 1 only allows 8.3 upper-case names; cloud-init
+                # reads the Rock Ridge / Joliet names
+                iso_name = f"/{name.replace('-', '').upper()[:8]}.;1"
+                iso.add_fp(BytesIO(data), len(data), iso_name,
+                           rr_name=name, joliet_path=f"/{name}")
+            iso.write(str(iso_path))
+        finally:
+            iso.close()
+
     def create_vm(self, config: VMConfig) -> VM:
         """Create a new VM."""
         try:
@@ -290,10 +718,10 @@ ethernets:
                     logger.warning(f"Found existing domain with name {config.name}, undefining it...")
                     try:
                         # Try to shutdown forcefully if running
-                        if existing_domain.isActive():
-                            existing_domain.destroy()
+                        self._destroy_domain(existing_domain)
                         # Undefine the domain
                         existing_domain.undefine()
+                        self._invalidate_domain(config.name)
                         logger.info(f"Successfully undefined existing domain {config.name}")
                     except Exception as undefine_error:
                         logger.error(f"Error undefining existing domain: {undefine_error}")
@@ -303,6 +731,10 @@ ethernets:
                 if "Domain not found" not in str(lookup_error):
                     logger.warning(f"Unexpected libvirt error when checking for domain: {lookup_error}")
 
+            # Reject unknown images before creating any directories,
+            # network config, or domains that would need cleaning up
+            self._check_image_available(config.image_id)
+
             # Create VM instance
             vm_id = str(uuid.uuid4())[:8]
             vm = VM(
@@ -320,10 +752,13 @@ ethernets:
             vm_dir.mkdir(parents=True, exist_ok=True)
 
             try:
-                # Make sure directory has proper permissions
-                # Use chmod to set permissions
+                # Make sure directory has proper permissions; chmod directly
+                # rather than forking a shell for every create
                 logger.info(f"Setting permissions on VM directory: {vm_dir}")
-                os.system(f"chmod -R 777 {vm_dir}")
+                for root, _, files in os.walk(vm_dir):
+                    os.chmod(root, 0o777)
+                    for name in files:
+                        os.chmod(os.path.join(root, name), 0o777)
                 
                 # We no longer need to chown here as the setup script handles this
                 
@@ -338,29 +773,34 @@ ethernets:
             except Exception as e:
                 logger.warning(f"Could not set directory permissions: {e}")
             
-            # Configure networking
-            vm.network_info = self._configure_networking(vm)
+            # Prepare the cloud image in the background while networking and
+            # the cloud-init ISO are set up, since the download usually dominates
+            with ThreadPoolExecutor(max_workers=1) as image_pool:
+                image_future = image_pool.submit(self._prepare_cloud_image, config.image_id)
+
+                # Configure networking
+                vm.network_info = self._configure_networking(vm)
+
+                # Create cloud-init configuration if provided
+                cloud_init_iso = None
+                if config.cloud_init:
+                    cloud_init_iso = self._prepare_cloud_init_config(config)
+                    if cloud_init_iso:
+                        logger.info(f"Created cloud-init config for VM {vm.name}")
 
-            # Prepare cloud image
-            cloud_image = self._prepare_cloud_image(config.image_id)
+                cloud_image = image_future.result()
             
             # Create VM disk - use absolute paths
             vm_disk_name = f"{vm.name}-{vm.id}.raw"
             vm_disk = vm_dir / vm_disk_name
             
             logger.info(f"Creating VM disk at {vm_disk}")
-            self._create_vm_disk(cloud_image, vm_disk, config.disk_size_gb)
+            vm_disk = self._create_vm_disk(cloud_image, vm_disk, config.disk_size_gb,
+                                           volume_name=self._disk_volume_name(vm))
             
             # Generate VM UUID
             vm_uuid = str(uuid.uuid4())
             
-            # Create cloud-init configuration if provided
-            cloud_init_iso = None
-            if config.cloud_init:
-                cloud_init_iso = self._prepare_cloud_init_config(config)
-                if cloud_init_iso:
-                    logger.info(f"Created cloud-init config for VM {vm.name}")
-            
             # Generate domain XML - make sure to use absolute path for disk
             domain_xml = self._generate_domain_xml(vm, vm_disk)
             
@@ -368,6 +808,7 @@ ethernets:
             domain = self.conn.defineXML(domain_xml)
             if not domain:
                 raise VMError(f"Failed to define domain for VM {vm.name}")
+            self._domain_cache[vm.name] = domain
             
             # If cloud-init ISO was created, attach it
             if cloud_init_iso:
@@ -375,6 +816,7 @@ ethernets:
             
             # Start the VM
             domain.create()
+            self._status_cache.pop(vm.name, None)
             
             # Update VM status
             vm.status = VMStatus.RUNNING
@@ -384,8 +826,10 @@ ethernets:
             vm.ssh_port = self._find_free_port()
             logger.info(f"Assigned SSH port {vm.ssh_port} for VM {vm.name}")
 
-            # Save VM to database
-            self._save_vm(vm)
+            # Save VM to database in a single upsert
+            with self._vms_lock:
+                self._save_vm(vm)
+                self.vms[vm.id] = vm
 
             # Start metrics collection
             self._start_metrics_collection(vm)
@@ -399,9 +843,76 @@ ethernets:
             # Attempt cleanup of failed VM
             if 'vm' in locals():
                 self._cleanup_failed_vm(vm.name)
+                self._release_port(vm.ssh_port)
                 
             raise VMError(f"Failed to create VM: {error_msg}")
 
+    def create_vms(self, configs: List[VMConfig]) -> List[VM]:
+        """Create several VMs concurrently, at most one per CPU at a time.
+
+        Every creation runs to completion; the first failure is re-raised
+        afterwards.
+        """
+        if not configs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(configs), os.cpu_count() or 1)) as pool:
+            futures = [pool.submit(self.create_vm, config) for config in configs]
+        return [future.result() for future in futures]
+
+    def _submit_job(self, description: str, func, *args,
+                    executor: Optional[ThreadPoolExecutor] = None) -> str:
+        """Run func(*args) on a background executor, _executor by default. Returns a job id."""
+        job_id = str(uuid.uuid4())
+        with self._jobs_lock:
+            self._expire_jobs()
+            future = (executor or self._executor).submit(func, *args)
+            self._jobs[job_id] = future
+        future.add_done_callback(lambda _: self._job_finished(job_id))
+        logger.info(f"Queued {description} as job {job_id}")
+        return job_id
+
+    def _job_finished(self, job_id: str) -> None:
+        """Record when a job finished, for _expire_jobs."""
+        with self._jobs_lock:
+            self._job_finished_at[job_id] = time.monotonic()
+
+    def _expire_jobs(self) -> None:
+        """Drop finished jobs older than JOB_RESULT_TTL. Caller holds _jobs_lock."""
+        cutoff = time.monotonic() - JOB_RESULT_TTL
+        for job_id, finished_at in list(self._job_finished_at.items()):
+            if finished_at < cutoff:
+                del self._job_finished_at[job_id]
+                self._jobs.pop(job_id, None)
+
+    def create_vm_async(self, config: VMConfig) -> str:
+        """Start creating a VM in the background. Returns a job id."""
+        return self._submit_job(f"creation of VM {config.name}", self.create_vm, config)
+
+    def delete_vm_async(self, vm_id: str) -> str:
+        """Start deleting a VM in the background. Returns a job id."""
+        return self._submit_job(f"deletion of VM {vm_id}", self.delete_vm, vm_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the state of a background job. Finished jobs expire after JOB_RESULT_TTL."""
+        with self._jobs_lock:
+            self._expire_jobs()
+            future = self._jobs.get(job_id)
+        if future is None:
+            return None
+
+        job = {'job_id': job_id, 'status': 'pending', 'result': None, 'error': None}
+        if future.running():
+            job['status'] = 'running'
+        elif future.done():
+            error = future.exception()
+            if error:
+                job['status'] = 'failed'
+                job['error'] = str(error)
+            else:
+                job['status'] = 'completed'
+                job['result'] = future.result()
+        return job
+
     def _init_storage_pool(self):
         """Initialize the default storage pool for QEMU/KVM"""
         try:
@@ -422,17 +933,7 @@ ethernets:
             # Ensure proper permissions
             subprocess.run(['sudo', 'chown', '-R', 'libvirt-qemu:libvirt-qemu', str(pool_path)], check=True)
             
-            pool_xml = f"""<pool type='dir'>
-  <name>default</name>
-  <target>
-    <path>{str(pool_path)}</path>
-    <permissions>
-      <mode>0755</mode>
-      <owner>64055</owner>
-      <group>64055</group>
-    </permissions>
-  </target>
-</pool>"""
+            pool_xml = POOL_XML_TEMPLATE.format(path=escape(str(pool_path)))
             
             pool = self.conn.storagePoolDefineXML(pool_xml)
             if not pool:
@@ -448,16 +949,37 @@ ethernets:
             logger.error(f"Error initializing storage pool: {str(e)}")
             raise
 
-    def _find_free_port(self, start_port: int = 2222) -> int:
-        port = start_port
-        while port < 65535:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(('127.0.0.1', port))
-                    return port
-            except OSError:
-                port += 1
-        raise Exception("No free ports available")
+    def _find_free_port(self) -> int:
+        """Allocate a free SSH port from SSH_PORT_RANGE.
+
+        Probing resumes after the last allocated port rather than re-probing
+        ports already handed out, and wraps around once so released ports are
+        reused.
+        """
+        global _next_port
+        start, end = SSH_PORT_RANGE.start, SSH_PORT_RANGE.stop
+        with _port_lock:
+            offset = _next_port - start
+            for i in range(len(SSH_PORT_RANGE)):
+                port = start + (offset + i) % (end - start)
+                if port in _allocated_ports:
+                    continue
+                try:
+                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                        s.bind(('127.0.0.1', port))
+                except OSError:
+                    continue
+                _allocated_ports.add(port)
+                _next_port = port + 1 if port + 1 < end else start
+                return port
+        raise VMError("No free SSH ports available")
+
+    def _release_port(self, port: Optional[int]) -> None:
+        """Return a VM's SSH port to the pool _find_free_port draws from."""
+        if port:
+            with _port_lock:
+                _allocated_ports.discard(port)
 
     def _generate_domain_xml(self, vm: VM, disk_path: Path) -> str:
         """Generate libvirt domain XML for VM."""
@@ -482,159 +1004,383 @@ ethernets:
                 
             logger.info(f"Using disk path for domain XML: {absolute_disk_path}")
             
-            # Create the XML template
-            root = ET.Element('domain', type='kvm')
-            ET.SubElement(root, 'name').text = vm.name
-            ET.SubElement(root, 'uuid').text = vm_uuid
-            ET.SubElement(root, 'memory', unit='MiB').text = str(memory_mb)
-            ET.SubElement(root, 'currentMemory', unit='MiB').text = str(memory_mb)
-            ET.SubElement(root, 'vcpu').text = str(cpu_cores)
-            
-            # OS settings
-            os_element = ET.SubElement(root, 'os')
-            ET.SubElement(os_element, 'type', arch='x86_64', machine='q35').text = 'hvm'
-            ET.SubElement(os_element, 'boot', dev='hd')
-        
-        # Features
-        features = ET.SubElement(root, 'features')
-        ET.SubElement(features, 'acpi')
-        ET.SubElement(features, 'apic')
-        
-            # CPU mode
-        cpu = ET.SubElement(root, 'cpu', mode='host-model')
-            
-            # Add security model with none driver - this disables the security checks
-            # and should resolve the permission issues
-            security = ET.SubElement(root, 'seclabel', type='none')
-        
-        # Devices
-        devices = ET.SubElement(root, 'devices')
-        
-        # Disk
-        disk = ET.SubElement(devices, 'disk', type='file', device='disk')
-            ET.SubElement(disk, 'driver', name='qemu', type='raw', cache='none', io='native')
-            ET.SubElement(disk, 'source', file=str(absolute_disk_path))
-        ET.SubElement(disk, 'target', dev='vda', bus='virtio')
-        
-        # Network interface
-            interface = ET.SubElement(devices, 'interface', type='bridge')
-            ET.SubElement(interface, 'source', bridge=bridge_name)
-            if mac_address:
-                ET.SubElement(interface, 'mac', address=mac_address)
-        ET.SubElement(interface, 'model', type='virtio')
-        
-            # Console
-            console = ET.SubElement(devices, 'console', type='pty')
-            ET.SubElement(console, 'target', type='serial', port='0')
-            
-            # VNC graphics
-            graphics = ET.SubElement(devices, 'graphics', type='vnc', port='-1', autoport='yes', listen='0.0.0.0')
-            ET.SubElement(graphics, 'listen', type='address', address='0.0.0.0')
-            
-            # Add a channel for qemu-guest-agent if it's installed
-            channel = ET.SubElement(devices, 'channel', type='unix')
-            ET.SubElement(channel, 'source', mode='bind')
-            ET.SubElement(channel, 'target', type='virtio', name='org.qemu.guest_agent.0')
-            
-            # Video
-            video = ET.SubElement(devices, 'video')
-            ET.SubElement(video, 'model', type='cirrus')
-            
-            # Create the XML string
-            xml_str = ET.tostring(root).decode()
-            logger.debug(f"Generated domain XML for VM {vm.name}")
+            # Only a handful of fields vary per VM, so fill in the prebuilt
+            # template rather than building an ElementTree on every create
+            mac_element = f"<mac address={quoteattr(mac_address)}/>" if mac_address else ''
+            xml_str = DOMAIN_XML_TEMPLATE.format(
+                name=escape(vm.name),
+                uuid=vm_uuid,
+                memory_mb=int(memory_mb),
+                cpu_cores=int(cpu_cores),
+                disk_path=quoteattr(str(absolute_disk_path)),
+                disk_format='qcow2' if absolute_disk_path.suffix == '.qcow2' else 'raw',
+                disk_cache=vm.config.disk_cache,
+                # Native AIO needs O_DIRECT; cached modes go through io_uring
+                disk_io='native' if vm.config.disk_cache in ('none', 'directsync') else 'io_uring',
+                root_disk_target=ROOT_DISK_TARGET,
+                bridge_name=quoteattr(bridge_name),
+                mac_element=mac_element
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                # The template is fixed, so only pay for a parse to check the
+                # output is well-formed when debugging
+                ET.fromstring(xml_str)
+                logger.debug(f"Generated domain XML for VM {vm.name}")
             
             return xml_str
         except Exception as e:
             logger.error(f"Error generating domain XML: {e}")
             raise VMError(f"Failed to generate domain XML: {e}")
 
-    def _merge_cloud_init(self, base: dict, custom: dict) -> None:
-        """Recursively merge custom cloud-init config into base config."""
-        for key, value in custom.items():
-            if key in base and isinstance(base[key], dict) and isinstance(value, dict):
-                self._merge_cloud_init(base[key], value)
-            elif key in base and isinstance(base[key], list) and isinstance(value, list):
-                base[key].extend(value)
-            else:
-                base[key] = value
-
     def _prepare_cloud_image(self, image_id: str) -> Path:
         """Download and prepare a cloud image if not already present."""
+        if image_id in self._cached_image_ids:
+            return self._cloud_image_path(image_id)
+        with self._image_locks_guard:
+            lock = self._image_locks.setdefault(image_id, threading.Lock())
+        with lock:
+            # Other API worker processes share the download directory and
+            # cache, so serialize against them too with an advisory file lock
+            lock_dir = self._get_absolute_path(Path("api/data/tmp"))
+            lock_dir.mkdir(parents=True, exist_ok=True)
+            with open(lock_dir / f"{image_id}.lock", 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    return self._prepare_cloud_image_locked(image_id)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def _cached_image_ids(self) -> Set[str]:
+        """IDs of prepared base images, scanned once on first use so later
+        checks are a set lookup rather than a stat."""
+        if self._image_id_set is None:
+            self._image_id_set = {
+                image.stem for image in self._cloud_image_path('').parent.glob('*.img')
+            }
+        return self._image_id_set
+
+    def _cloud_image_path(self, image_id: str) -> Path:
+        """Where the prepared base image for image_id lives."""
         # Use the same directory as VM storage for images
-        images_dir = self._get_absolute_path(Path("api/data/vms"))
-        images_dir.mkdir(parents=True, exist_ok=True)
-        
-        cloud_image = images_dir / f"{image_id}.img"
-        
-        # Images mapping - add more as needed
-        image_urls = {
-            'ubuntu-20.04': 'https://cloud-images.ubuntu.com/releases/focal/release/ubuntu-20.04-server-cloudimg-amd64.img',
-            'ubuntu-22.04': 'https://cloud-images.ubuntu.com/releases/jammy/release/ubuntu-22.04-server-cloudimg-amd64.img',
-            'debian-11': 'https://cloud.debian.org/images/cloud/bullseye/latest/debian-11-generic-amd64.qcow2',
-            'debian-12': 'https://cloud.debian.org/images/cloud/bookworm/latest/debian-12-generic-amd64.qcow2',
-            'centos-9-stream': 'https://cloud.centos.org/centos/9-stream/x86_64/images/CentOS-Stream-GenericCloud-9-latest.x86_64.qcow2',
-            'alpine-3.17': 'https://dl-cdn.alpinelinux.org/alpine/v3.17/releases/x86_64/alpine-virt-3.17.0-x86_64.iso',
-        }
+        return self._get_absolute_path(Path("api/data/vms")) / f"{image_id}.img"
+
+    def _check_image_available(self, image_id: str) -> None:
+        """Fail fast on image IDs that are neither prepared locally nor downloadable."""
+        if image_id not in CLOUD_IMAGE_URLS and image_id not in self._cached_image_ids:
+            raise VMError(f"Unknown image ID: {image_id}. Available images: {', '.join(CLOUD_IMAGE_URLS.keys())}")
+
+    def _prepare_cloud_image_locked(self, image_id: str) -> Path:
+        cloud_image = self._cloud_image_path(image_id)
+        cloud_image.parent.mkdir(parents=True, exist_ok=True)
         
         if not cloud_image.exists():
             # If image doesn't exist, download it
-            if image_id not in image_urls:
-                raise VMError(f"Unknown image ID: {image_id}. Available images: {', '.join(image_urls.keys())}")
+            self._check_image_available(image_id)
             
-            logger.info(f"Downloading cloud image {image_id}...")
-            url = image_urls[image_id]
+            url = CLOUD_IMAGE_URLS[image_id]
+            cached_image = self._cached_image_path(url)
             
-            # Create a temporary directory for downloads
-            tmp_dir = self._get_absolute_path(Path("api/data/tmp"))
-            tmp_dir.mkdir(parents=True, exist_ok=True)
-            tmp_file = tmp_dir / f"{image_id}-download.img"
-            
-            try:
-                # Download the image with progress
-                logger.info(f"Downloading {url} to {tmp_file}")
+            if not cached_image.exists():
+                logger.info(f"Downloading cloud image {image_id}...")
                 
-                # Use wget with progress
-                result = subprocess.run(
-                    ["wget", "-O", str(tmp_file), url], 
-                    check=True,
-                    capture_output=True,
-                    text=True
-                )
+                # Create a temporary directory for downloads
+                tmp_dir = self._get_absolute_path(Path("api/data/tmp"))
+                tmp_dir.mkdir(parents=True, exist_ok=True)
+                tmp_file = tmp_dir / f"{image_id}-download.img"
                 
-                # Check if download succeeded
-                if result.returncode != 0:
-                    raise VMError(f"Failed to download cloud image: {result.stderr}")
-                
-                # Make sure the image is valid
-                validate_cmd = ["qemu-img", "info", str(tmp_file)]
-                result = subprocess.run(validate_cmd, capture_output=True, text=True)
-                if result.returncode != 0:
-                    raise VMError(f"Downloaded image is not valid: {result.stderr}")
-                
-                # Move to final location
-                shutil.move(str(tmp_file), str(cloud_image))
+                try:
+                    # Download the image with progress
+                    logger.info(f"Downloading {url} to {tmp_file}")
+                    
+                    # A corrupt download is discarded and fetched once more
+                    for _ in range(2):
+                        self._download_image(url, tmp_file)
+                        digest = self._file_sha256(tmp_file)
+                        if self._image_checksum_matches(url, digest):
+                            break
+                        logger.warning(f"Checksum mismatch for {url}, discarding download")
+                        tmp_file.unlink()
+                    else:
+                        raise VMError(f"Checksum mismatch for {url} after retrying")
+                    
+                    # Make sure the image is valid
+                    self._validate_image(tmp_file)
+                    
+                    # Move into the shared image cache
+                    self._store_cached_image(tmp_file, digest, cached_image)
+                    
+                except requests.RequestException as e:
+                    # Keep the partial file so the next attempt can resume it
+                    logger.error(f"Error downloading cloud image: {e}")
+                    raise VMError(f"Failed to download cloud image: {e}")
+                    
+                except Exception as e:
+                    logger.error(f"Error preparing cloud image: {e}")
+                    if tmp_file.exists():
+                        tmp_file.unlink()
+                    raise VMError(f"Failed to prepare cloud image: {e}")
+            else:
+                logger.info(f"Using cached cloud image {cached_image} for {image_id}")
+            
+            try:
+                self._link_cached_image(cached_image, cloud_image)
                 
                 # Set proper permissions on the cloud image
                 logger.info(f"Setting permissions on cloud image: {cloud_image}")
-                os.system(f"chmod 666 {cloud_image}")
-                
-                logger.info(f"Successfully downloaded and installed {image_id} image")
-                
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Error downloading cloud image: {e}")
-                if tmp_file.exists():
-                    tmp_file.unlink()
-                raise VMError(f"Failed to download cloud image: {e}")
+                try:
+                    os.chmod(cloud_image, 0o666)
+                except PermissionError as e:
+                    logger.warning(f"Failed to set permissions on cloud image: {e}")
                 
-            except Exception as e:
-                logger.error(f"Error preparing cloud image: {e}")
-                if tmp_file.exists():
-                    tmp_file.unlink()
-                raise VMError(f"Failed to prepare cloud image: {e}")
+                logger.info(f"Successfully installed {image_id} image")
+            except OSError as e:
+                logger.error(f"Error installing cloud image: {e}")
+                raise VMError(f"Failed to install cloud image: {e}")
+
+        if image_id not in self._cached_image_ids:
+            self._cached_image_ids.add(image_id)
+            for listener in self._image_available_listeners:
+                try:
+                    listener(image_id)
+                except Exception as e:
+                    logger.warning(f"image_available listener failed for {image_id}: {e}")
                 
         return cloud_image
 
+    def warm_image(self, image_id: str) -> Optional[str]:
+        """Prepare an image in the background. Returns a job id, or None if already cached."""
+        if image_id in self._cached_image_ids:
+            return None
+        self._check_image_available(image_id)
+        return self._submit_job(f"warm-up of image {image_id}", self._prepare_cloud_image, image_id,
+                                executor=self._warm_executor)
+
+    def on_image_available(self, listener: Callable[[str], None]) -> None:
+        """Register listener(image_id) to be called whenever an image becomes cached."""
+        self._image_available_listeners.append(listener)
+
+    def _cached_image_path(self, url: str) -> Path:
+        """Location of an image in the shared cache, keyed by its source URL."""
+        return self.image_cache_dir / hashlib.sha256(url.encode()).hexdigest()
+
+    def _link_cached_image(self, cached_image: Path, dest: Path) -> None:
+        """Expose a cached image at dest without copying its bytes when possible."""
+        try:
+            os.link(cached_image, dest)
+        except OSError as e:
+            # Hard links can't cross filesystems; fall back to a real copy
+            logger.info(f"Could not hard-link {cached_image} to {dest} ({e}), copying instead")
+            shutil.copyfile(cached_image, dest)
+
+    def _download_image(self, url: str, dest: Path) -> None:
+        """Download a remote image to dest, in parallel ranges when the server allows it."""
+        try:
+            head = self.session.head(url, allow_redirects=True, timeout=self.request_timeout)
+            total_size = int(head.headers.get('content-length', 0))
+            supports_ranges = head.ok and head.headers.get('accept-ranges', '').lower() == 'bytes'
+        except requests.RequestException as e:
+            logger.debug(f"HEAD request for {url} failed, using a single stream: {e}")
+            total_size, supports_ranges = 0, False
+
+        # A partial file from an earlier attempt is resumed over one stream
+        if supports_ranges and total_size >= PARALLEL_DOWNLOAD_MIN_SIZE and not dest.exists():
+            self._download_ranges(url, dest, total_size)
+            return
+        # A connection dropped mid-stream leaves a partial dest, which the
+        # next attempt resumes rather than fetching from the start
+        for attempt in range(DOWNLOAD_RESUME_ATTEMPTS):
+            try:
+                self._download_stream(url, dest)
+                return
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError) as e:
+                if attempt == DOWNLOAD_RESUME_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"Download of {url} interrupted ({e}), resuming")
+                time.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt)
+
+    def _download_ranges(self, url: str, dest: Path, total_size: int,
+                         num_conns: int = DOWNLOAD_CONNECTIONS) -> None:
+        """Fetch url with num_conns concurrent Range requests written in place."""
+        part_size = -(-total_size // num_conns)
+        ranges = [(start, min(start + part_size, total_size) - 1)
+                  for start in range(0, total_size, part_size)]
+
+        fd = os.open(str(dest), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, total_size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, total_size)
+
+            def fetch_range(start: int, end: int) -> None:
+                headers = {'Range': f'bytes={start}-{end}'}
+                with self.session.get(url, headers=headers, stream=True,
+                                      timeout=self.request_timeout) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise VMError(f"Server ignored range request for {url}")
+                    # One reusable buffer per range instead of a new bytes
+                    # object for every chunk
+                    response.raw.decode_content = True
+                    buf = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
+                    offset = start
+                    while n := response.raw.readinto(buf):
+                        view = buf[:n]
+                        while view:
+                            written = os.pwrite(fd, view, offset)
+                            offset += written
+                            view = view[written:]
+                if offset != end + 1:
+                    raise VMError(f"Incomplete download of bytes {start}-{end} from {url}")
+
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(fetch_range, start, end) for start, end in ranges]
+                for future in futures:
+                    future.result()
+        except BaseException:
+            # A preallocated file with holes can't be resumed; don't leave it behind
+            os.close(fd)
+            dest.unlink(missing_ok=True)
+            raise
+        os.close(fd)
+
+    def _download_stream(self, url: str, dest: Path) -> None:
+        """Stream a remote image to dest over a single connection.
+
+        A partial dest left by an interrupted download is resumed with a
+        Range request when the server supports it. The ETag of the original
+        response is kept beside it and sent as If-Range, so a file that
+        changed upstream in the meantime is fetched whole rather than
+        spliced onto stale bytes.
+        """
+        etag_file = dest.with_name(dest.name + '.etag')
+        offset = dest.stat().st_size if dest.exists() else 0
+        headers = None
+        if offset:
+            headers = {'Range': f'bytes={offset}-'}
+            if etag_file.exists():
+                headers['If-Range'] = etag_file.read_text()
+        with self.session.get(url, headers=headers, stream=True, timeout=self.request_timeout) as response:
+            if offset and response.status_code != 206:
+                restart = True
+            else:
+                restart = False
+                response.raise_for_status()
+                if offset:
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                total_size = offset + int(response.headers.get('content-length', 0))
+                etag = response.headers.get('ETag')
+                if not offset and etag and not etag.startswith('W/'):
+                    # Weak ETags can't be used with If-Range
+                    etag_file.write_text(etag)
+
+                # Let urllib3 undo any transfer encoding so we can copy the raw
+                # stream in C instead of looping over small chunks in Python
+                response.raw.decode_content = True
+                with open(dest, 'r+b' if offset else 'wb') as f:
+                    f.seek(offset)
+                    if total_size > offset and hasattr(os, 'posix_fallocate'):
+                        # Reserve the space up front to avoid fragmenting the image
+                        try:
+                            os.posix_fallocate(f.fileno(), offset, total_size - offset)
+                        except OSError as e:
+                            logger.debug(f"posix_fallocate not supported for {dest}: {e}")
+                    try:
+                        self._copy_download(response.raw, f, url, offset, total_size)
+                    finally:
+                        # Drop any preallocated tail so a partial file can be resumed
+                        f.truncate(f.tell())
+                etag_file.unlink(missing_ok=True)
+
+        if restart:
+            # The server can't continue this file, or it has changed; start over
+            logger.info(f"Cannot resume download of {url}, restarting")
+            dest.unlink()
+            etag_file.unlink(missing_ok=True)
+            self._download_stream(url, dest)
+
+    def _copy_download(self, src, f, url: str, offset: int, total_size: int) -> None:
+        """Copy a response body into f through one reusable buffer.
+
+        Progress is only checked once per DOWNLOAD_CHUNK_SIZE block and logged
+        every DOWNLOAD_PROGRESS_STEP of total_size.
+        """
+        buf = bytearray(DOWNLOAD_CHUNK_SIZE)
+        view = memoryview(buf)
+        step = int(total_size * DOWNLOAD_PROGRESS_STEP) if total_size > offset else 0
+        downloaded = next_log = offset
+        while True:
+            n = src.readinto(buf)
+            if not n:
+                break
+            f.write(view[:n])
+            downloaded += n
+            if step and downloaded >= next_log:
+                logger.info(f"Downloaded {100 * downloaded // total_size}% of {url}")
+                next_log = downloaded + step
+
+    def _file_sha256(self, path: Path) -> str:
+        """Hex SHA-256 digest of a file's contents, read in one sequential pass.
+
+        The pages are left in the page cache: the hashed image becomes the
+        base that new VM disks are created from right after.
+        """
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            sha256 = hashlib.sha256()
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _store_cached_image(self, image: Path, digest: str, cached_image: Path) -> None:
+        """Move a downloaded image into the cache, keyed by content as well as URL.
+
+        Image bytes live once under sha256/<digest>; the URL-keyed cache entry
+        is a hard link to them, so URLs serving identical images (e.g. a
+        release and its "current" alias) share one copy on disk.
+        """
+        blob = self.image_cache_dir / 'sha256' / digest
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.exists():
+            logger.info(f"Image content already cached as {blob}, reusing it")
+            image.unlink()
+        else:
+            shutil.move(str(image), str(blob))
+        self._link_cached_image(blob, cached_image)
+
+    def _published_checksums(self, base_url: str) -> Dict[str, str]:
+        """SHA256SUMS published in a directory as {filename: digest}, fetched once per directory."""
+        checksums = self._checksum_cache.get(base_url)
+        if checksums is not None:
+            return checksums
+        try:
+            response = self.session.get(f"{base_url}/SHA256SUMS", timeout=self.request_timeout)
+        except requests.RequestException as e:
+            # Not cached, so a transient failure is retried next time
+            logger.warning(f"Could not fetch checksums from {base_url}: {e}")
+            return {}
+
+        checksums = {}
+        if response.ok:
+            for line in response.text.splitlines():
+                parts = line.split()
+                if len(parts) == 2:
+                    checksums[parts[1].lstrip('*')] = parts[0].lower()
+        self._checksum_cache[base_url] = checksums
+        return checksums
+
+    def _image_checksum_matches(self, url: str, digest: str) -> bool:
+        """Check an image's digest against the SHA256SUMS published next to it, if any."""
+        base_url, filename = url.rsplit('/', 1)
+        expected = self._published_checksums(base_url).get(filename)
+        if expected is None:
+            logger.info(f"No published checksum for {url}, skipping checksum verification")
+            return True
+        return digest == expected
+
     def _get_absolute_path(self, path: Path) -> Path:
         """Convert a relative path to an absolute path."""
         if path.is_absolute():
@@ -655,11 +1401,19 @@ ethernets:
             # We're in the project root
             return cwd / path
 
-    def _create_vm_disk(self, cloud_image: Path, vm_disk: Path, size_gb: int) -> None:
-        """Create a VM disk based on a cloud image."""
+    def _create_vm_disk(self, cloud_image: Path, vm_disk: Path, size_gb: int,
+                        volume_name: Optional[str] = None) -> Path:
+        """Create a VM disk based on a cloud image and return its path.
+
+        Where the base image and vm_disk share a filesystem that supports
+        reflinks, vm_disk is a raw reflink clone of the base. Otherwise the
+        disk is created as a qcow2 volume named volume_name in the default
+        storage pool, backed by the base image.
+        """
         try:
-            # Make sure we're using absolute paths
-            abs_cloud_image = self._get_absolute_path(cloud_image)
+            # Make sure we're using absolute paths; the base is canonicalized
+            # so every overlay records the same backing file path
+            abs_cloud_image = self._get_absolute_path(cloud_image).resolve()
             abs_vm_disk = self._get_absolute_path(vm_disk)
             
             # Make sure the base image exists
@@ -680,54 +1434,35 @@ ethernets:
             logger.info(f"Creating VM disk {abs_vm_disk} based on {abs_cloud_image}")
             
             # Detect the format of the source image
-            format_cmd = ['qemu-img', 'info', '--output=json', str(abs_cloud_image)]
-            format_result = subprocess.run(
-                format_cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            # Parse the format from json output
-            img_info = json.loads(format_result.stdout)
-            source_format = img_info.get('format', 'qcow2')  # Default to qcow2 if not detected
-            
+            source_format = self._detect_image_format(abs_cloud_image)
             logger.info(f"Detected source image format: {source_format}")
             
-            # Create a raw image with the base cloud image
-            cmd = [
-                'qemu-img', 'convert',
-                '-f', source_format,
-                '-O', 'raw',
-                str(abs_cloud_image),
-                str(abs_vm_disk)
-            ]
-            
-            logger.info(f"Running command: {' '.join(cmd)}")
-            
-            result = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            # Resize the disk to the requested size
-            resize_cmd = ['qemu-img', 'resize', str(abs_vm_disk), f"{size_gb}G"]
-            logger.info(f"Resizing disk: {' '.join(resize_cmd)}")
-            
-            resize_result = subprocess.run(
-                resize_cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            cloned = False
+            if self._reflink_available(abs_cloud_image.parent, abs_vm_disk.parent):
+                # A reflinked raw disk shares the base's blocks until the guest
+                # writes them, without a qcow2 backing chain on every read
+                try:
+                    abs_vm_disk = self._clone_raw_disk(abs_cloud_image, source_format, abs_vm_disk, size_gb)
+                    cloned = True
+                except OSError as e:
+                    logger.warning(f"Reflink clone of {abs_cloud_image} failed ({e}), using an overlay volume")
+            if not cloned:
+                # Let libvirt create a copy-on-write overlay on the base image,
+                # avoiding the qemu-img processes and a full copy of the image
+                abs_vm_disk = self._create_overlay_volume(
+                    abs_cloud_image, source_format,
+                    volume_name or abs_vm_disk.with_suffix('.qcow2').name, size_gb)
             
             # Set permissions on the disk file to make it accessible to libvirt
             logger.info(f"Setting permissions on VM disk file: {abs_vm_disk}")
             try:
-                # Make the disk file readable and writable by everyone
-                os.system(f"chmod 666 {abs_vm_disk}")
+                # Make the disk file readable and writable by everyone; a
+                # pool volume may belong to libvirt, so don't let a failure
+                # here skip the directories below
+                try:
+                    os.chmod(abs_vm_disk, 0o666)
+                except PermissionError as e:
+                    logger.warning(f"Failed to set permissions on VM disk file: {e}")
                 
                 # We no longer need to chown here as the setup script handles this
                 
@@ -743,6 +1478,7 @@ ethernets:
                 logger.warning(f"Failed to set permissions on VM disk file: {perm_error}")
             
             logger.info(f"Successfully created VM disk at {abs_vm_disk}")
+            return abs_vm_disk
             
         except subprocess.CalledProcessError as e:
             logger.error(f"Command '{e.cmd}' returned non-zero exit status {e.returncode}")
@@ -754,6 +1490,118 @@ ethernets:
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise VMError(f"Failed to create VM disk: {e}")
 
+    def _clone_raw_disk(self, base_image: Path, base_format: str, vm_disk: Path, size_gb: int) -> Path:
+        """Reflink a raw version of base_image to vm_disk and grow it to size_gb.
+
+        Raises OSError if the filesystem refuses the clone; this never falls
+        back to copying the data.
+        """
+        raw_base = self._get_raw_base_image(base_image, base_format)
+        try:
+            with open(raw_base, 'rb') as fsrc, open(vm_disk, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            vm_disk.unlink(missing_ok=True)
+            raise
+        # A raw image's file size is its virtual size, so growing it is
+        # just extending the file
+        if vm_disk.stat().st_size < size_gb * 1024 ** 3:
+            os.truncate(vm_disk, size_gb * 1024 ** 3)
+        return vm_disk
+
+    def _reflink_available(self, base_dir: Path, target_dir: Path) -> bool:
+        """Whether files in base_dir can be reflinked into target_dir, checked once per pair."""
+        # Disks on a remote hypervisor are created through its storage pool;
+        # local directories say nothing about its filesystems
+        if self.uri != LOCAL_URI:
+            return False
+        key = (base_dir, target_dir)
+        if key not in self._reflink_supported:
+            # Reflinks can't cross filesystems, so skip the probe outright
+            if base_dir.stat().st_dev != target_dir.stat().st_dev:
+                self._reflink_supported[key] = False
+            else:
+                src = base_dir / f".reflink-probe-{os.getpid()}-{threading.get_ident()}"
+                dst = target_dir / f"{src.name}.clone"
+                try:
+                    src.write_bytes(b'\0')
+                    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    self._reflink_supported[key] = True
+                except OSError:
+                    self._reflink_supported[key] = False
+                finally:
+                    src.unlink(missing_ok=True)
+                    dst.unlink(missing_ok=True)
+            logger.info(f"Reflink copies {'are' if self._reflink_supported[key] else 'are not'} "
+                        f"supported from {base_dir} to {target_dir}")
+        return self._reflink_supported[key]
+
+    def _detect_image_format(self, image: Path) -> str:
+        """Identify qcow2 images by their header magic; anything else is raw."""
+        with open(image, 'rb') as f:
+            return 'qcow2' if f.read(len(QCOW2_MAGIC)) == QCOW2_MAGIC else 'raw'
+
+    def _get_raw_base_image(self, base_image: Path, base_format: str) -> Path:
+        """Return a raw version of base_image, converting it once and keeping it beside the original."""
+        if base_format == 'raw':
+            return base_image
+        raw_image = base_image.with_suffix('.raw')
+        if not raw_image.exists():
+            tmp_image = base_image.with_suffix(f'.raw.{os.getpid()}.{threading.get_ident()}.tmp')
+            cmd = ['qemu-img', 'convert', '-f', base_format, '-O', 'raw',
+                   str(base_image), str(tmp_image)]
+            logger.info(f"Converting base image to raw: {' '.join(cmd)}")
+            try:
+                subprocess.run(cmd, check=True, capture_output=True, text=True)
+                os.replace(tmp_image, raw_image)
+            finally:
+                tmp_image.unlink(missing_ok=True)
+        return raw_image
+
+    def _validate_image(self, image: Path) -> None:
+        """Sanity-check a downloaded image's header without spawning qemu-img."""
+        with open(image, 'rb') as f:
+            header = f.read(QCOW2_HEADER.size)
+        if not header:
+            raise VMError(f"Downloaded image is empty: {image}")
+        if header.startswith(QCOW2_MAGIC):
+            if len(header) < QCOW2_HEADER.size:
+                raise VMError(f"Downloaded image has a truncated qcow2 header: {image}")
+            _, version, _, _, cluster_bits, size = QCOW2_HEADER.unpack(header)
+            if version not in (2, 3) or not 9 <= cluster_bits <= 21 or size == 0:
+                raise VMError(f"Downloaded image has an invalid qcow2 header: {image}")
+
+    def _disk_volume_name(self, vm: VM) -> str:
+        """Name of the VM's root disk volume in the default storage pool."""
+        return f"{vm.name}-{vm.id}.qcow2"
+
+    def _create_overlay_volume(self, base_image: Path, base_format: str,
+                               name: str, size_gb: int) -> Path:
+        """Create a qcow2 volume backed by base_image in the default pool."""
+        pool = self._get_default_pool()
+        vol_xml = VOLUME_XML_TEMPLATE.format(
+            name=escape(name),
+            size_gb=int(size_gb),
+            backing_path=escape(str(base_image)),
+            backing_format=base_format,
+            # Btrfs CoW on top of qcow2's own allocation fragments the image badly
+            nocow_element='\n    <nocow/>' if self._pool_is_btrfs() else ''
+        )
+        volume = pool.createXML(vol_xml, 0)
+        if not volume:
+            raise VMError(f"Failed to create volume {name}")
+        # Volumes in a dir pool live directly under its target path
+        return self._get_pool_path() / name
+
+    def _delete_disk_volume(self, vm: VM) -> None:
+        """Remove the VM's root disk volume from the default pool, if present."""
+        try:
+            pool = self._get_default_pool()
+            pool.storageVolLookupByName(self._disk_volume_name(vm)).delete(0)
+        except libvirt.libvirtError as e:
+            logger.debug(f"No disk volume to remove for VM {vm.id}: {e}")
+
     def _configure_networking(self, vm: VM) -> Dict:
         """Configure networking for a VM."""
         try:
@@ -796,22 +1644,20 @@ ethernets:
                 netmask = ip_elem.get('netmask')
             
             # Generate a MAC address if not already set
-            if not hasattr(vm, 'mac_address'):
-                # Generate a random MAC address
-                mac = [0x52, 0x54, 0x00,
-                      random.randint(0x00, 0xff),
-                      random.randint(0x00, 0xff),
-                      random.randint(0x00, 0xff)]
-                vm.mac_address = ':'.join([f'{x:02x}' for x in mac])
+            mac_address = (vm.network_info or {}).get('mac_address')
+            if not mac_address:
+                # Generate a random MAC address under the QEMU/KVM OUI,
+                # formatted in C by bytes.hex rather than per-octet f-strings
+                mac = QEMU_MAC_PREFIX | random.getrandbits(24)
+                mac_address = mac.to_bytes(6, 'big').hex(':')
             
             # Allocate an IP from the IP manager if available
             ip_address = None
             if hasattr(self, 'ip_manager') and self.ip_manager:
                 try:
-                    # Get an available IP address
-                    ip_address = self.ip_manager.get_available_ip()
+                    # Claim an available IP address
+                    ip_address = self.ip_manager.reserve_ip(vm.id)
                     if ip_address:
-                        self.ip_manager.attach_ip(ip_address, vm.id)
                         logger.info(f"Allocated IP {ip_address} for VM {vm.name}")
                 except Exception as e:
                     logger.warning(f"Failed to allocate IP from IP manager: {e}")
@@ -822,7 +1668,7 @@ ethernets:
                 'bridge_name': bridge_name,
                 'network_address': network_address,
                 'netmask': netmask,
-                'mac_address': getattr(vm, 'mac_address', None),
+                'mac_address': mac_address,
                 'ip_address': ip_address
             }
             
@@ -836,93 +1682,119 @@ ethernets:
     def _start_vm(self, vm: VM) -> None:
         """Start the VM using libvirt."""
         try:
-            # Get the storage pool
-            pool = self.conn.storagePoolLookupByName('default')
-            if not pool.isActive():
-                pool.create()
-
-            # Get the disk path
-            disk_path = Path(pool.getInfo()[0]) / f"{vm.name}.qcow2"
-
-            # Generate the domain XML
-            domain_xml = self._generate_domain_xml(vm, disk_path)
-
-            # Create and start the domain
-            domain = self.conn.defineXML(domain_xml)
-            if not domain:
-                raise Exception("Failed to define domain")
+            # create_vm already defined the domain; only rebuild the XML if
+            # it has gone missing from libvirt
+            try:
+                domain = self._get_domain(vm)
+            except libvirt.libvirtError:
+                domain = self.conn.defineXML(self._generate_domain_xml(vm, self._vm_disk_path(vm)))
+                if not domain:
+                    raise Exception("Failed to define domain")
+                self._domain_cache[vm.name] = domain
 
-            domain.create()
+            try:
+                domain.create()
+            except libvirt.libvirtError as e:
+                # Already running; no need to probe isActive() up front
+                if e.get_error_code() != libvirt.VIR_ERR_OPERATION_INVALID:
+                    raise
+            self._status_cache.pop(vm.name, None)
             logger.info(f"Started VM {vm.name}")
         except Exception as e:
             raise Exception(f"Failed to start VM: {str(e)}")
 
+    def _vm_disk_path(self, vm: VM) -> Path:
+        """Locate the VM's root disk, preferring the pool volume over the raw fallback."""
+        try:
+            pool = self._get_default_pool()
+            return Path(pool.storageVolLookupByName(self._disk_volume_name(vm)).path())
+        except libvirt.libvirtError:
+            return self._get_absolute_path(self.vm_dir / vm.id / f"{vm.name}-{vm.id}.raw")
+
     def list_images(self) -> List[Dict[str, str]]:
+        # Serve repeat calls from memory without touching disk or network
+        if self._image_list_cache is not None:
+            expires_at, cached_images = self._image_list_cache
+            if time.monotonic() < expires_at:
+                return cached_images
+
         try:
             # First try to get from cache
             cache_file = self.vm_dir / "image_cache.json"
             if cache_file.exists():
                 cache_age = time.time() - cache_file.stat().st_mtime
                 if cache_age < 3600:  # Cache valid for 1 hour
-                    with open(cache_file) as f:
-                        cached_images = json.load(f)
-                        if cached_images:  # Only return cache if it's not empty
-                            return cached_images
-
-            # If cache miss or expired, fetch from Ubuntu cloud images
+                    try:
+                        cached_images = json.loads(cache_file.read_bytes())
+                    except ValueError:
+                        # Unreadable cache; refetch and overwrite it below
+                        cached_images = None
+                    if cached_images:  # Only return cache if it's not empty
+                        self._image_list_cache = (time.monotonic() + IMAGE_LIST_TTL, cached_images)
+                        return cached_images
+
+            # If cache miss or expired, fetch from Ubuntu cloud images,
+            # revalidating against the index we last parsed
+            headers = {'User-Agent': 'VM-Manager/1.0'}
+            if self._image_index is not None:
+                headers.update(self._image_index[0])
             response = self.session.get(
                 self.ubuntu_daily_base_url,
                 timeout=self.request_timeout,
-                headers={'User-Agent': 'VM-Manager/1.0'}
+                headers=headers
             )
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            images = []
-            
-            # Look for .img files
-            for link in soup.find_all('a'):
-                href = link.get('href', '')
-                if href.endswith('.img'):
-                    match = re.search(r'ubuntu-(\d+\.\d+).*?\.img', href)
-                    if match:
-                        version = match.group(1)
-                        image_id = f"ubuntu-{version}"
-                        images.append({
-                            "id": image_id,
-                            "name": f"Ubuntu {version}",
-                            "version": version,
-                            "url": self.ubuntu_daily_base_url + href
-                        })
+            if response.status_code == 304 and self._image_index is not None:
+                # Unchanged since the last fetch; skip parsing entirely and just
+                # extend the file cache's lifetime instead of rewriting it
+                images = self._image_index[1]
+                if cache_file.exists():
+                    os.utime(cache_file)
+                    self._image_list_cache = (time.monotonic() + IMAGE_LIST_TTL, images)
+                    return images
+            else:
+                # Scan the raw bytes for image links rather than building an HTML tree
+                images = []
+                for href, version in self._image_href_re.findall(response.content):
+                    version = version.decode()
+                    images.append({
+                        "id": f"ubuntu-{version}",
+                        "name": f"Ubuntu {version}",
+                        "version": version,
+                        "url": self.ubuntu_daily_base_url + href.decode()
+                    })
+                # Newest release first, comparing (major, minor) as integers
+                images.sort(key=lambda image: tuple(map(int, image['version'].split('.'))),
+                            reverse=True)
+
+                validators = {}
+                if 'ETag' in response.headers:
+                    validators['If-None-Match'] = response.headers['ETag']
+                if 'Last-Modified' in response.headers:
+                    validators['If-Modified-Since'] = response.headers['Last-Modified']
+                if images and validators:
+                    self._image_index = (validators, images)
             
             if images:  # Only cache if we found images
-                # Cache the results
-                with open(cache_file, 'w') as f:
-                    json.dump(images, f)
+                # Cache the results, replacing the file atomically so a crash
+                # mid-write can't leave a truncated cache behind
+                tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+                tmp_file.write_bytes(orjson.dumps(images))
+                os.replace(tmp_file, cache_file)
+                self._image_list_cache = (time.monotonic() + IMAGE_LIST_TTL, images)
                 return images
             
-            # If no images found or error occurred, return default image
-            return [
-                {
-                    "id": "ubuntu-20.04",
-                    "name": "Ubuntu 20.04 LTS",
-                    "version": "20.04",
-                    "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img"
-                }
-            ]
+            # If no images found, return the default image
+            self._image_list_cache = (time.monotonic() + IMAGE_LIST_ERROR_TTL, DEFAULT_IMAGE_LIST)
+            return DEFAULT_IMAGE_LIST
             
         except Exception as e:
             logger.error(f"Error listing images: {str(e)}")
             logger.error(traceback.format_exc())
             # Always return at least the default image
-            return [
-                {
-                    "id": "ubuntu-20.04",
-                    "name": "Ubuntu 20.04 LTS",
-                    "version": "20.04",
-                    "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img"
-                }
-            ]
+            self._image_list_cache = (time.monotonic() + IMAGE_LIST_ERROR_TTL, DEFAULT_IMAGE_LIST)
+            return DEFAULT_IMAGE_LIST
 
     def delete_vm(self, vm_id: str) -> None:
         """Delete a VM with proper cleanup."""
@@ -934,12 +1806,13 @@ ethernets:
 
             # Stop VM if running
             try:
-                domain = self.conn.lookupByName(vm.name)
-                if domain.isActive():
-                    domain.destroy()
+                domain = self._get_domain(vm)
+                self._destroy_domain(domain)
                 domain.undefine()
             except libvirt.libvirtError as e:
                 logger.warning(f"Error stopping VM domain: {e}")
+            finally:
+                self._invalidate_domain(vm.name)
 
             # Release IP if allocated
             if vm.network_info and 'public' in vm.network_info:
@@ -949,22 +1822,29 @@ ethernets:
                 except Exception as e:
                     logger.error(f"Error detaching IP {public_ip} from VM {vm_id}: {e}")
 
-            # Clean up VM directory
+            # Move the VM directory out of the way now (a single rename) and
+            # leave deleting the disk files to a background thread
             vm_dir = self.vm_dir / vm_id
+            trash_dir = None
             if vm_dir.exists():
                 try:
-                    shutil.rmtree(vm_dir)
+                    trash_dir = vm_dir.with_name(f".{vm_id}.deleting")
+                    vm_dir.rename(trash_dir)
+                except OSError as e:
+                    logger.error(f"Error moving VM directory aside: {e}")
+                    trash_dir = vm_dir
+            self._executor.submit(self._cleanup_vm_storage, vm, trash_dir)
+
+            with self._vms_lock:
+                # Remove from database
+                try:
+                    db.delete_vm(vm_id)
                 except Exception as e:
-                    logger.error(f"Error removing VM directory: {e}")
-
-            # Remove from database
-            try:
-                db.delete_vm(vm_id)
-            except Exception as e:
-                logger.error(f"Error removing VM from database: {e}")
+                    logger.error(f"Error removing VM from database: {e}")
 
-            # Remove from memory
-            self.vms.pop(vm_id, None)
+                # Remove from memory
+                self.vms.pop(vm_id, None)
+            self._release_port(vm.ssh_port)
 
             logger.info(f"Successfully deleted VM {vm_id}")
 
@@ -972,6 +1852,16 @@ ethernets:
             logger.error(f"Error deleting VM {vm_id}: {e}")
             raise
 
+    def _cleanup_vm_storage(self, vm: VM, vm_dir: Optional[Path]) -> None:
+        """Delete a removed VM's root disk volume and directory."""
+        # Remove the root disk volume from the storage pool
+        self._delete_disk_volume(vm)
+        if vm_dir is not None:
+            try:
+                shutil.rmtree(vm_dir)
+            except Exception as e:
+                logger.error(f"Error removing VM directory {vm_dir}: {e}")
+
     def list_disks(self) -> List[Dict]:
         """List all disks"""
         try:
@@ -997,6 +1887,14 @@ ethernets:
         """Detach a disk from its VM."""
         self.disk_manager.detach_disk(disk_id)
 
+    def attach_disks(self, disk_ids: List[str], vm_name: str) -> None:
+        """Attach several disks to a VM in one batch."""
+        self.disk_manager.attach_disks(disk_ids, vm_name)
+
+    def detach_disks(self, disk_ids: List[str]) -> None:
+        """Detach several disks in one batch."""
+        self.disk_manager.detach_disks(disk_ids)
+
     def get_disk(self, disk_id: str) -> Optional[Dict]:
         """Get disk details."""
         disk = self.disk_manager.get_disk(disk_id)
@@ -1010,14 +1908,45 @@ ethernets:
         """Get all disks attached to a VM."""
         return self.disk_manager.get_machine_disks(vm_name)
 
-    def list_vms(self) -> List[VM]:
-        """List all VMs with their current status"""
+    def list_vms(self, limit: Optional[int] = None, offset: int = 0) -> List[VM]:
+        """List VMs in creation order with their current status.
+
+        With limit set, only that many VMs starting at offset are returned.
+        """
+        states = self._get_domain_states()
         vms = []
-        for vm_id, vm in self.vms.items():
-            vm.status = self.get_vm_status(vm_id)
+        with self._vms_lock:
+            stop = None if limit is None else offset + limit
+            stored_vms = list(islice(self.vms.items(), offset, stop))
+        for vm_id, vm in stored_vms:
+            if states is not None:
+                vm.status = states.get(vm.name, 'not_found')
+            else:
+                vm.status = self.get_vm_status(vm_id)
             vms.append(vm)
         return vms
 
+    def _get_domain_states(self) -> Optional[Dict[str, str]]:
+        """Fetch the state of every domain in one getAllDomainStats RPC.
+
+        Returns a mapping of domain name to state name, or None if the bulk
+        query failed and callers should fall back to per-domain lookups.
+        """
+        try:
+            records = self.conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_STATE)
+        except libvirt.libvirtError as e:
+            logger.warning(f"Bulk domain stats query failed: {e}")
+            return None
+
+        states = {}
+        now = time.monotonic()
+        for domain, stats in records:
+            name = domain.name()
+            self._domain_cache[name] = domain
+            states[name] = domain_state_name(stats.get('state.state'))
+            self._status_cache[name] = (now, states[name])
+        return states
+
     def get_vm(self, vm_id: str) -> Optional[VM]:
         """Get a VM by its ID"""
         return self.vms.get(vm_id)
@@ -1029,23 +1958,24 @@ ethernets:
             if not vm:
                 return 'not_found'
 
-            domain = self.conn.lookupByName(vm.name)
+            cached = self._status_cache.get(vm.name)
+            now = time.monotonic()
+            if cached and now - cached[0] < VM_STATUS_TTL:
+                return cached[1]
+
+            domain = self._get_domain(vm)
             if not domain:
                 return 'not_found'
 
             state, reason = domain.state()
-            states = {
-                libvirt.VIR_DOMAIN_NOSTATE: 'no_state',
-                libvirt.VIR_DOMAIN_RUNNING: 'running',
-                libvirt.VIR_DOMAIN_BLOCKED: 'blocked',
-                libvirt.VIR_DOMAIN_PAUSED: 'paused',
-                libvirt.VIR_DOMAIN_SHUTDOWN: 'shutdown',
-                libvirt.VIR_DOMAIN_SHUTOFF: 'shutoff',
-                libvirt.VIR_DOMAIN_CRASHED: 'crashed',
-                libvirt.VIR_DOMAIN_PMSUSPENDED: 'suspended'
-            }
-            return states.get(state, 'unknown')
+            status = domain_state_name(state)
+            self._status_cache[vm.name] = (now, status)
+            return status
         except libvirt.libvirtError:
+            # The cached handle may point at a domain that was undefined
+            # outside of this manager; drop it so the next poll re-resolves.
+            if vm:
+                self._invalidate_domain(vm.name)
             return 'not_found'
         except Exception as e:
             logger.error(f"Error getting VM status: {str(e)}")
@@ -1054,46 +1984,47 @@ ethernets:
     def get_metrics(self, vm: VM) -> Dict[str, Any]:
         """Get current metrics for a VM"""
         try:
-            domain = self.conn.lookupByName(vm.name)
+            domain = self._get_domain(vm)
             if not domain:
                 raise Exception("VM domain not found")
 
-            # Get CPU stats
-            cpu_stats = domain.getCPUStats(True)[0]
-            cpu_time = cpu_stats.get('cpu_time', 0)
-            system_time = cpu_stats.get('system_time', 0)
-            user_time = cpu_stats.get('user_time', 0)
+            # CPU, balloon, block and interface stats in one RPC instead of a
+            # call per category, disk and interface
+            records = self.conn.domainListGetStats([domain], METRICS_STATS)
+            stats = records[0][1] if records else {}
+
+            cpu_time = stats.get('cpu.time', 0)
+            system_time = stats.get('cpu.system', 0)
+            user_time = stats.get('cpu.user', 0)
 
-            # Get memory stats
-            memory_stats = domain.memoryStats()
-            actual = memory_stats.get('actual', 0)
-            available = memory_stats.get('available', 0)
-            unused = memory_stats.get('unused', 0)
+            actual = stats.get('balloon.current', 0)
+            available = stats.get('balloon.available', 0)
+            unused = stats.get('balloon.unused', 0)
 
-            # Get disk stats
+            # Every disk and interface is reported, keyed by target device
+            # and host interface name
             disk_stats = {}
-            for disk in domain.disks:
-                stats = domain.blockStats(disk)
-                disk_stats[disk] = {
-                    'read_bytes': stats[0],
-                    'read_requests': stats[1],
-                    'write_bytes': stats[2],
-                    'write_requests': stats[3]
+            for i in range(stats.get('block.count', 0)):
+                prefix = f'block.{i}.'
+                disk_stats[stats[prefix + 'name']] = {
+                    'read_bytes': stats.get(prefix + 'rd.bytes', 0),
+                    'read_requests': stats.get(prefix + 'rd.reqs', 0),
+                    'write_bytes': stats.get(prefix + 'wr.bytes', 0),
+                    'write_requests': stats.get(prefix + 'wr.reqs', 0)
                 }
 
-            # Get network stats
             net_stats = {}
-            for interface in domain.interfaceAddresses(libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT).keys():
-                stats = domain.interfaceStats(interface)
-                net_stats[interface] = {
-                    'rx_bytes': stats[0],
-                    'rx_packets': stats[1],
-                    'rx_errors': stats[2],
-                    'rx_drops': stats[3],
-                    'tx_bytes': stats[4],
-                    'tx_packets': stats[5],
-                    'tx_errors': stats[6],
-                    'tx_drops': stats[7]
+            for i in range(stats.get('net.count', 0)):
+                prefix = f'net.{i}.'
+                net_stats[stats[prefix + 'name']] = {
+                    'rx_bytes': stats.get(prefix + 'rx.bytes', 0),
+                    'rx_packets': stats.get(prefix + 'rx.pkts', 0),
+                    'rx_errors': stats.get(prefix + 'rx.errs', 0),
+                    'rx_drops': stats.get(prefix + 'rx.drop', 0),
+                    'tx_bytes': stats.get(prefix + 'tx.bytes', 0),
+                    'tx_packets': stats.get(prefix + 'tx.pkts', 0),
+                    'tx_errors': stats.get(prefix + 'tx.errs', 0),
+                    'tx_drops': stats.get(prefix + 'tx.drop', 0)
                 }
 
             return {
@@ -1118,22 +2049,17 @@ ethernets:
     def resize_cpu(self, vm: VM, cpu_cores: int) -> None:
         """Resize the number of CPU cores for a VM"""
         try:
-            domain = self.conn.lookupByName(vm.name)
+            domain = self._get_domain(vm)
             if not domain:
                 raise Exception("VM domain not found")
 
-            # Update XML configuration
-            xml = domain.XMLDesc()
-            tree = ET.ElementTree(ET.fromstring(xml))
-            vcpu = tree.find('.//vcpu')
-            if vcpu is not None:
-                vcpu.text = str(cpu_cores)
-                new_xml = ET.tostring(tree.getroot(), encoding='unicode')
-                
-                # Apply new configuration
-                if domain.isActive():
-                    domain.setVcpus(cpu_cores)
-                domain.updateDeviceFlags(new_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+            # Set the counts directly rather than round-tripping the domain XML
+            if domain.isActive():
+                domain.setVcpusFlags(cpu_cores, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+            self._set_config_maximum(
+                cpu_cores, vm.config.cpu_cores, domain.setVcpusFlags,
+                libvirt.VIR_DOMAIN_VCPU_MAXIMUM)
+            self._status_cache.pop(vm.name, None)
 
             # Update VM config
             vm.config.cpu_cores = cpu_cores
@@ -1145,25 +2071,18 @@ ethernets:
     def resize_memory(self, vm: VM, memory_mb: int) -> None:
         """Resize the memory for a VM"""
         try:
-            domain = self.conn.lookupByName(vm.name)
+            domain = self._get_domain(vm)
             if not domain:
                 raise Exception("VM domain not found")
 
-            # Update XML configuration
-            xml = domain.XMLDesc()
-            tree = ET.ElementTree(ET.fromstring(xml))
-            memory = tree.find('.//memory')
-            currentMemory = tree.find('.//currentMemory')
-            if memory is not None and currentMemory is not None:
-                memory_kb = memory_mb * 1024
-                memory.text = str(memory_kb)
-                currentMemory.text = str(memory_kb)
-                new_xml = ET.tostring(tree.getroot(), encoding='unicode')
-                
-                # Apply new configuration
-                if domain.isActive():
-                    domain.setMemory(memory_kb)
-                domain.updateDeviceFlags(new_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+            # Set the sizes directly rather than round-tripping the domain XML
+            memory_kb = memory_mb * 1024
+            if domain.isActive():
+                domain.setMemoryFlags(memory_kb, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+            self._set_config_maximum(
+                memory_kb, vm.config.memory_mb * 1024, domain.setMemoryFlags,
+                libvirt.VIR_DOMAIN_MEM_MAXIMUM)
+            self._status_cache.pop(vm.name, None)
 
             # Update VM config
             vm.config.memory_mb = memory_mb
@@ -1172,20 +2091,35 @@ ethernets:
             logger.error(f"Error resizing memory: {str(e)}")
             raise
 
+    def _set_config_maximum(self, value: int, current: int,
+                            setter: Callable[[int, int], int], maximum_flag: int) -> None:
+        """Set both the persistent current and maximum of a resource to value.
+
+        Domains are defined with current equal to maximum, and libvirt
+        rejects a current above the maximum, so the maximum is raised first
+        when growing and lowered last when shrinking.
+        """
+        config = libvirt.VIR_DOMAIN_AFFECT_CONFIG
+        if value > current:
+            setter(value, config | maximum_flag)
+            setter(value, config)
+        else:
+            setter(value, config)
+            setter(value, config | maximum_flag)
+
     def _save_vm(self, vm: VM) -> None:
         """Save VM configuration to the database"""
         try:
-            db.update_vm(vm.id, {
-                'name': vm.name,
-                'cpu_cores': vm.config.cpu_cores,
-                'memory_mb': vm.config.memory_mb,
-                'disk_size_gb': vm.config.disk_size_gb,
-                'network_name': vm.config.network_name,
-                'cloud_init': vm.config.cloud_init,
-                'image_id': vm.config.image_id,
-                'network_info': vm.network_info,
-                'ssh_port': vm.ssh_port
-            })
+            with self._vms_lock:
+                db.save_vm(vm.id, {
+                    'name': vm.name,
+                    **asdict(vm.config),
+                    'network_info': vm.network_info,
+                    'ssh_port': vm.ssh_port,
+                    'status': vm.status,
+                    'created_at': vm.created_at,
+                    'error_message': vm.error_message
+                })
         except Exception as e:
             logger.error(f"Error saving VM configuration: {str(e)}")
             raise
@@ -1193,89 +2127,30 @@ ethernets:
     def _prepare_cloud_init_config(self, config: VMConfig) -> Optional[str]:
         """Prepare cloud-init configuration for VM. Returns path to cloud-init ISO."""
         try:
-        if not config.cloud_init:
+            if not config.cloud_init:
                 logger.info("No cloud-init config provided, using defaults")
-            return None
+                return None
             
-            # Create temp directory for cloud-init files
-            cloud_init_dir = Path(f"api/data/tmp/cloud-init-{config.name}")
-            cloud_init_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Default cloud-init configuration
-            default_config = {
-                'hostname': config.name,
-                'users': [{
-                    'name': 'ubuntu',
-                    'shell': '/bin/bash',
-                    'sudo': 'ALL=(ALL) NOPASSWD:ALL',
-                    'ssh_authorized_keys': []
-                }],
-                'packages': ['qemu-guest-agent', 'cloud-init'],
-                'package_update': True,
-                'package_upgrade': True,
-                'runcmd': ['systemctl enable qemu-guest-agent', 'systemctl start qemu-guest-agent'],
-                'write_files': []
-            }
+            iso_path = self._cloud_init_iso_path(config.name)
+            iso_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # Merge custom config with defaults
-            merged_config = default_config.copy()
-            self._merge_cloud_init(merged_config, config.cloud_init)
+            # Merge custom config over a private copy of the defaults; merging
+            # extends lists in place, so the shared constant must not be touched
+            merged_config = {'hostname': config.name, **copy.deepcopy(MINIMAL_CLOUD_INIT)}
+            merge_cloud_init(merged_config, config.cloud_init)
             
             # Generate cloud-init files
-            user_data = f"""#cloud-config
-{json.dumps(merged_config, indent=2)}
-"""
-            
-            meta_data = f"""instance-id: {config.name}
-local-hostname: {merged_config['hostname']}
-"""
-            
-            network_config = """version: 2
-ethernets:
-  ens3:
-    dhcp4: true
-"""
-            
-            # Write cloud-init files
-            with open(cloud_init_dir / "user-data", "w") as f:
-                f.write(user_data)
-                
-            with open(cloud_init_dir / "meta-data", "w") as f:
-                f.write(meta_data)
-                
-            with open(cloud_init_dir / "network-config", "w") as f:
-                f.write(network_config)
-                
-            # Generate ISO file
-            iso_path = cloud_init_dir / "cloud-init.iso"
-            
-            # Check if mkisofs or genisoimage is available
-            iso_cmd = None
-            for cmd in ["mkisofs", "genisoimage"]:
-                try:
-                    subprocess.run(["which", cmd], check=True, capture_output=True)
-                    iso_cmd = cmd
-                    break
-                except subprocess.CalledProcessError:
-                    continue
-                    
-            if not iso_cmd:
-                logger.warning("Neither mkisofs nor genisoimage found, cannot create cloud-init ISO")
-                return None
-                
-            # Create cloud-init ISO
-            cmd = [
-                iso_cmd,
-                "-output", str(iso_path),
-                "-volid", "cidata",
-                "-joliet",
-                "-rock",
-                str(cloud_init_dir / "user-data"),
-                str(cloud_init_dir / "meta-data"),
-                str(cloud_init_dir / "network-config")
-            ]
-            
-            subprocess.run(cmd, check=True, capture_output=True)
+            user_data = CLOUD_CONFIG_HEADER + orjson.dumps(merged_config)
+            meta_data = MINIMAL_META_DATA_TEMPLATE.format(instance_id=config.name,
+                                                          hostname=merged_config['hostname'])
+            
+            # Build the ISO in-process straight from memory; no intermediate
+            # files and no mkisofs/genisoimage fork
+            self._write_cloud_init_iso(iso_path, {
+                'user-data': user_data,
+                'meta-data': meta_data.encode(),
+                'network-config': MINIMAL_NETWORK_CONFIG
+            })
             
             logger.info(f"Created cloud-init ISO at {iso_path}")
             return str(iso_path)
@@ -1284,21 +2159,20 @@ ethernets:
             logger.error(f"Error creating cloud-init config: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
             return None
-            
+
+    def _cloud_init_iso_path(self, vm_name: str) -> Path:
+        """Absolute path of the cloud-init ISO built for a custom config."""
+        return self._get_absolute_path(Path(f"api/data/tmp/cloud-init-{vm_name}") / "cloud-init.iso")
+
     def _attach_cloud_init_iso(self, vm_name: str, iso_path: str):
         """Attach cloud-init ISO to the VM."""
         try:
-            domain = self.conn.lookupByName(vm_name)
+            # create_vm has just cached the handle it defined
+            domain = self._domain_cache.get(vm_name) or self.conn.lookupByName(vm_name)
             
             # Generate disk XML
-            disk_xml = f"""
-            <disk type='file' device='cdrom'>
-                <driver name='qemu' type='raw'/>
-                <source file='{iso_path}'/>
-                <target dev='hdc' bus='ide'/>
-                <readonly/>
-            </disk>
-            """
+            disk_xml = disk_device_xml(iso_path, 'hdc', bus='ide', device='cdrom',
+                                       driver_type='raw', readonly=True, cache='unsafe')
             
             domain.attachDevice(disk_xml)
             
@@ -1308,11 +2182,10 @@ ethernets:
             
     def _cleanup_failed_vm(self, vm_name: str):
         """Cleanup resources after failed VM creation."""
+        self._invalidate_domain(vm_name)
         try:
-            # Remove cloud-init ISO if it exists
-            iso_path = f"/var/lib/libvirt/images/cloud-init-{vm_name}.iso"
-            if os.path.exists(iso_path):
-                os.remove(iso_path)
+            # Remove the cloud-init ISO and its directory if they exist
+            shutil.rmtree(self._cloud_init_iso_path(vm_name).parent, ignore_errors=True)
                 
             # Existing cleanup logic...
             
@@ -1336,7 +2209,8 @@ ethernets:
                             network_usage=metrics['network'],
                             timestamp=time.time()
                         ))
-                        self._save_vm(vm)
+                        # Metrics stay in memory; only refresh the row's status
+                        db.update_vm_state(vm.id, vm.status, vm.error_message)
 
                     time.sleep(60)  # Collect metrics every minute
                 except Exception as e:
@@ -1353,7 +2227,7 @@ ethernets:
             if not vm:
                 raise VMError(f"VM {vm_id} not found")
 
-            domain = self.conn.lookupByName(vm.name)
+            domain = self._get_domain(vm)
             if not domain:
                 raise VMError(f"VM domain {vm.name} not found")
 
@@ -1442,28 +2316,42 @@ class VMManager:
         """Initialize the VM manager."""
         self.network_manager = network_manager
         self.ip_manager = ip_manager
+        # LibvirtManager loads the stored VMs from the database on init, so
+        # there is no need for a second scan here
         self.libvirt_manager = LibvirtManager(ip_manager=ip_manager)
         
-        # Database connection is already initialized
-        # This is just to make sure VMs are loaded on startup
-        self._load_vms()
-        
         logger.info("VMManager initialized successfully")
 
     def _load_vms(self):
-        self.libvirt_manager._load_vms()
+        """Reload the VM table from the database."""
+        self.libvirt_manager.vms = self.libvirt_manager._load_vms()
             
     def create_vm(self, config: VMConfig) -> VM:
         return self.libvirt_manager.create_vm(config)
     
+    def create_vms(self, configs: List[VMConfig]) -> List[VM]:
+        return self.libvirt_manager.create_vms(configs)
+    
+    def warm_image(self, image_id: str) -> Optional[str]:
+        return self.libvirt_manager.warm_image(image_id)
+
+    def create_vm_async(self, config: VMConfig) -> str:
+        return self.libvirt_manager.create_vm_async(config)
+    
+    def delete_vm_async(self, vm_id: str) -> str:
+        return self.libvirt_manager.delete_vm_async(vm_id)
+    
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.libvirt_manager.get_job(job_id)
+    
     def get_vm(self, vm_id: str) -> Optional[VM]:
         return self.libvirt_manager.get_vm(vm_id)
     
     def delete_vm(self, vm_id: str) -> None:
         return self.libvirt_manager.delete_vm(vm_id)
     
-    def list_vms(self) -> List[VM]:
-        return self.libvirt_manager.list_vms()
+    def list_vms(self, limit: Optional[int] = None, offset: int = 0) -> List[VM]:
+        return self.libvirt_manager.list_vms(limit, offset)
     
     def get_vm_status(self, vm_id: str) -> str:
         return self.libvirt_manager.get_vm_status(vm_id)
@@ -1482,6 +2370,18 @@ class VMManager:
     
     def resize_memory(self, vm: VM, memory_mb: int) -> None:
         return self.libvirt_manager.resize_memory(vm, memory_mb)
+    
+    def attach_disk(self, disk_id: str, vm_name: str) -> None:
+        return self.libvirt_manager.attach_disk(disk_id, vm_name)
+    
+    def detach_disk(self, disk_id: str) -> None:
+        return self.libvirt_manager.detach_disk(disk_id)
+    
+    def attach_disks(self, disk_ids: List[str], vm_name: str) -> None:
+        return self.libvirt_manager.attach_disks(disk_ids, vm_name)
+    
+    def detach_disks(self, disk_ids: List[str]) -> None:
+        return self.libvirt_manager.detach_disks(disk_ids)
 
 
 class VMConsole:
@@ -1493,7 +2393,7 @@ class VMConsole:
 
     def connect(self):
         try:
-            domain = self.libvirt_manager.conn.lookupByName(self.vm.name)
+            domain = self.libvirt_manager._get_domain(self.vm)
             if not domain:
                 raise Exception("VM domain not found")
 
@@ -1512,7 +2412,7 @@ class VMConsole:
             raise Exception("Console not connected")
         
         try:
-            domain = self.libvirt_manager.conn.lookupByName(self.vm.name)
+            domain = self.libvirt_manager._get_domain(self.vm)
             if not domain:
                 raise Exception("VM domain not found")
 
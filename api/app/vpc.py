@@ -1,3 +1,4 @@
+import os
 import json
 import logging
 import ipaddress
@@ -41,7 +42,10 @@ class VPCManager:
     def _load_vpcs(self) -> Dict[str, VPC]:
         """Load VPCs from disk."""
         vpcs = {}
-        for vpc_file in self.vpc_dir.glob("*.json"):
+        with os.scandir(self.vpc_dir) as entries:
+            vpc_files = [entry.path for entry in entries
+                         if entry.name.endswith(".json") and entry.is_file(follow_symlinks=False)]
+        for vpc_file in vpc_files:
             try:
                 with open(vpc_file) as f:
                     data = json.load(f)
@@ -31,7 +31,7 @@ install_packages() {
     apt-get update
     apt-get install -y qemu-kvm libvirt-daemon-system libvirt-clients bridge-utils virtinst
     apt-get install -y python3-pip python3-venv
-    apt-get install -y qemu-utils cloud-image-utils
+    apt-get install -y qemu-utils
     apt-get install -y iptables-persistent
     apt-get install -y wget curl jq
 }
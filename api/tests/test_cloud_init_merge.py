@@ -0,0 +1,35 @@
+import importlib.util
+from pathlib import Path
+
+CLOUD_CONFIG_PATH = Path(__file__).resolve().parent.parent / "app" / "cloud_config.py"
+
+# Loaded by path so the test needs neither flask (app/__init__) nor libvirt
+spec = importlib.util.spec_from_file_location("cloud_config_under_test", CLOUD_CONFIG_PATH)
+cloud_config = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cloud_config)
+merge = cloud_config.merge_cloud_init
+
+
+def test_merge_skips_packages_already_present():
+    base = {"packages": ["qemu-guest-agent", "curl"]}
+    merge(base, {"packages": ["curl", "htop", "htop"]})
+    assert base["packages"] == ["qemu-guest-agent", "curl", "htop"]
+
+
+def test_merge_dedups_set_like_lists_in_nested_dicts():
+    base = {"users": {"admin": {"ssh_authorized_keys": ["ssh-ed25519 AAA"]}}}
+    merge(base, {"users": {"admin": {"ssh_authorized_keys": ["ssh-ed25519 AAA", "ssh-rsa BBB"]}}})
+    assert base["users"]["admin"]["ssh_authorized_keys"] == ["ssh-ed25519 AAA", "ssh-rsa BBB"]
+
+
+def test_merge_keeps_repeated_commands_in_order():
+    base = {"runcmd": ["apt-get update", "systemctl enable qemu-guest-agent"]}
+    custom = ["add-apt-repository -y ppa:x", "apt-get update", "apt-get install -y foo"]
+    merge(base, {"runcmd": custom})
+    assert base["runcmd"] == ["apt-get update", "systemctl enable qemu-guest-agent", *custom]
+
+
+def test_merge_replaces_non_list_values():
+    base = {"packages": ["curl"], "hostname": "old"}
+    merge(base, {"packages": "vim", "hostname": "new"})
+    assert base == {"packages": "vim", "hostname": "new"}
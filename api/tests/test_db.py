@@ -0,0 +1,54 @@
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+DB_MODULE_PATH = Path(__file__).resolve().parent.parent / "app" / "db.py"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # db.py opens api/data/vm.db relative to the working directory, including
+    # for the module-level instance created on import
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("db_under_test", DB_MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Database()
+
+
+def add_available_ips(database, count):
+    ips = [f"10.0.0.{i}" for i in range(1, count + 1)]
+    for ip in ips:
+        database.create_ip(ip, {"state": "available"})
+    return ips
+
+
+def test_claim_ip_attaches_first_available(database):
+    ips = add_available_ips(database, 2)
+
+    assert database.claim_ip("vm-1") == ips[0]
+    claimed = database.get_ip(ips[0])
+    assert claimed["state"] == "attached"
+    assert claimed["machine_id"] == "vm-1"
+    assert database.get_ip(ips[1])["state"] == "available"
+
+
+def test_claim_ip_never_hands_out_the_same_ip_twice(database):
+    ips = add_available_ips(database, 20)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = list(pool.map(database.claim_ip, [f"vm-{i}" for i in range(20)]))
+
+    assert sorted(claimed) == sorted(ips)
+    owners = {row["ip"]: row["machine_id"] for row in database.list_ips()}
+    assert sorted(owners.values()) == sorted(f"vm-{i}" for i in range(20))
+
+
+def test_claim_ip_returns_none_when_pool_exhausted(database):
+    (ip,) = add_available_ips(database, 1)
+
+    assert database.claim_ip("vm-1") == ip
+    assert database.claim_ip("vm-2") is None
+    assert database.get_ip(ip)["machine_id"] == "vm-1"
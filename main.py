@@ -2,6 +2,7 @@
 
 import argparse
 import os
+import signal
 import subprocess
 import sys
 import time
@@ -9,15 +10,35 @@ import json
 from pathlib import Path
 import shutil
 import requests
+import urllib3
+from urllib3.util import Retry
 from typing import Optional, List, Dict
 from vpc import VPCManager, VPC, VPCError
 import logging
 from datetime import datetime
 import socket
 from tqdm import tqdm
+from io import BytesIO
+import pycdlib
 
 logger = logging.getLogger(__name__)
 
+# SSH forwarding ports handed to VMs, kept below the kernel's ephemeral
+# range (32768+) so they can't collide with outgoing connections
+SSH_PORT_RANGE = range(2222, 32768)
+
+# Retries for transient HTTP failures when downloading the base image, with
+# exponential backoff (seconds) between them
+HTTP_MAX_RETRIES = 5
+HTTP_RETRY_BACKOFF = 1
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds for image downloads
+DOWNLOAD_TIMEOUT = (10, 60)
+
+# Times the image download is resumed after the connection drops
+DOWNLOAD_RESUME_ATTEMPTS = 3
+
 class VMError(Exception):
     """Base exception for VM-related errors"""
     pass
@@ -34,6 +55,7 @@ class VMManager:
         self.vm_dir.mkdir(parents=True, exist_ok=True)
         self.vpc_manager = VPCManager()
         self._metadata_file = self.vm_dir / "vm_metadata.json"
+        self._vm_pid_cache: Dict[str, int] = {}
         self._load_metadata()
 
     def _load_metadata(self) -> None:
@@ -53,7 +75,8 @@ class VMManager:
     def _save_metadata(self) -> None:
         """Save VM metadata to file"""
         try:
-            self._metadata_file.write_text(json.dumps(self._metadata, indent=2))
+            # Rewritten on every state change, so keep it compact
+            self._metadata_file.write_text(json.dumps(self._metadata, separators=(',', ':')))
         except Exception as e:
             logger.error(f"Error saving metadata: {str(e)}")
             raise VMError(f"Failed to save metadata: {str(e)}")
@@ -92,36 +115,106 @@ class VMManager:
             return
 
         url = "https://cloud-images.ubuntu.com/releases/jammy/release/ubuntu-22.04-server-cloudimg-arm64.img"
+        # Download next to the target and rename on success, so an
+        # interrupted download never passes the exists() check above. A
+        # .part left by an interrupted run is resumed rather than restarted
+        part_file = img_file.with_suffix('.part')
+        session = requests.Session()
+        retry = Retry(total=HTTP_MAX_RETRIES, backoff_factor=HTTP_RETRY_BACKOFF,
+                      status_forcelist=HTTP_RETRY_STATUSES,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        session.mount('https://', requests.adapters.HTTPAdapter(max_retries=retry))
         try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-            total = int(response.headers.get('content-length', 0))
-            with img_file.open('wb') as f, tqdm(
-                desc="Downloading Ubuntu image",
-                total=total,
-                unit='iB',
-                unit_scale=True
-            ) as pbar:
-                for data in response.iter_content(chunk_size=1024):
-                    size = f.write(data)
-                    pbar.update(size)
-                    
-            self.log("Ubuntu image downloaded successfully")
-        except Exception as e:
-            self.error(f"Failed to download Ubuntu image: {e}")
-
-    def _find_free_port(self, start_port: int = 2222) -> int:
-        """Find a free port starting from start_port"""
-        port = start_port
-        while port < 65535:
+            for attempt in range(DOWNLOAD_RESUME_ATTEMPTS):
+                try:
+                    self._download_stream(session, url, part_file)
+                    break
+                except (requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError) as e:
+                    if attempt == DOWNLOAD_RESUME_ATTEMPTS - 1:
+                        # Keep the partial file for the next run to resume
+                        self.error(f"Failed to download Ubuntu image: {e}")
+                    self.warn(f"Download interrupted ({e}), resuming")
+                    time.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt)
+                except Exception as e:
+                    part_file.unlink(missing_ok=True)
+                    self.error(f"Failed to download Ubuntu image: {e}")
+            os.replace(part_file, img_file)
+        finally:
+            session.close()
+        # Versions of the old image that no VM disk backs onto are now unused
+        self._prune_base_versions(img_file)
+
+        self.log("Ubuntu image downloaded successfully")
+
+    def _download_stream(self, session: requests.Session, url: str, dest: Path) -> None:
+        """Stream url to dest, resuming a partial dest with a Range request.
+
+        The ETag of the original response is kept beside dest and sent as
+        If-Range, so a file that changed upstream in the meantime is fetched
+        whole rather than spliced onto stale bytes.
+        """
+        etag_file = dest.with_name(dest.name + '.etag')
+        offset = dest.stat().st_size if dest.exists() else 0
+        headers = None
+        if offset:
+            headers = {'Range': f'bytes={offset}-'}
+            if etag_file.exists():
+                headers['If-Range'] = etag_file.read_text()
+        with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if offset and response.status_code != 206:
+                restart = True
+            else:
+                restart = False
+                response.raise_for_status()
+                total = offset + int(response.headers.get('content-length', 0))
+                etag = response.headers.get('ETag')
+                if not offset and etag and not etag.startswith('W/'):
+                    # Weak ETags can't be used with If-Range
+                    etag_file.write_text(etag)
+
+                response.raw.decode_content = True
+                with open(dest, 'ab' if offset else 'wb', buffering=1024 * 1024) as f, tqdm.wrapattr(
+                    f, "write",
+                    desc="Downloading Ubuntu image",
+                    total=total,
+                    initial=offset,
+                    unit='iB',
+                    unit_scale=True
+                ) as out:
+                    shutil.copyfileobj(response.raw, out, length=1024 * 1024)
+                    f.flush()
+                    os.fsync(f.fileno())
+                etag_file.unlink(missing_ok=True)
+
+        if restart:
+            # The server can't continue this file, or it has changed; start over
+            self.warn("Cannot resume the Ubuntu image download, restarting")
+            dest.unlink()
+            etag_file.unlink(missing_ok=True)
+            self._download_stream(session, url, dest)
+
+    def _find_free_port(self) -> int:
+        """Find a free port in SSH_PORT_RANGE, skipping ports recorded for other VMs.
+
+        Probing resumes after the highest recorded port and wraps around once,
+        so ports of deleted VMs are reused.
+        """
+        assigned = {meta["ssh_port"] for meta in self._metadata.values() if meta.get("ssh_port")}
+        start, end = SSH_PORT_RANGE.start, SSH_PORT_RANGE.stop
+        offset = max((p + 1 - start for p in assigned if p in SSH_PORT_RANGE), default=0)
+        for i in range(len(SSH_PORT_RANGE)):
+            port = start + (offset + i) % (end - start)
+            if port in assigned:
+                continue
             try:
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(('127.0.0.1', port))
-                    return port
+                    # QEMU's hostfwd listens on all interfaces, so probe the same
+                    s.bind(('', port))
             except OSError:
-                port += 1
-        raise VMError("No free ports available")
+                continue
+            return port
+        raise VMError("No free SSH ports available")
 
     def _install_dependencies(self) -> None:
         """Install required system packages."""
@@ -133,8 +226,6 @@ class VMManager:
             packages = [
                 'qemu-system-aarch64',  # QEMU for ARM64
                 'qemu-utils',           # QEMU utilities
-                'cloud-image-utils',    # For cloud image manipulation
-                'mkisofs',              # For ISO creation
             ]
             
             subprocess.run(['sudo', 'apt-get', 'install', '-y'] + packages, check=True)
@@ -155,20 +246,84 @@ class VMManager:
             image_path = self.vm_dir / "ubuntu-22.04-server-cloudimg-arm64.img"
             
             if not image_path.exists():
-                # Download the image
-                subprocess.run(['wget', '-O', str(image_path), image_url], check=True)
+                # Download the image, only moving it into place once complete
+                part_path = image_path.with_suffix('.part')
+                try:
+                    if shutil.which('aria2c'):
+                        # Several connections at once; falls back to wget's single stream
+                        subprocess.run(['aria2c', '-x', '8', '-s', '8', '-k', '1M',
+                                        '--allow-overwrite=true', '--auto-file-renaming=false',
+                                        '-d', str(part_path.parent), '-o', part_path.name,
+                                        image_url], check=True)
+                    else:
+                        subprocess.run(['wget', '-O', str(part_path), image_url], check=True)
+                    os.replace(part_path, image_path)
+                finally:
+                    part_path.unlink(missing_ok=True)
             
-            # Convert and resize the image
+            # Convert and resize the image, unless an earlier run already did
             qcow2_file = self.vm_dir / "ubuntu-22.04-server-cloudimg-arm64.qcow2"
-        subprocess.run(['qemu-img', 'convert', '-f', 'qcow2', '-O', 'qcow2', 
-                          str(image_path), str(qcow2_file)], check=True)
-        subprocess.run(['qemu-img', 'resize', str(qcow2_file), '20G'], check=True)
+            if not qcow2_file.exists():
+                subprocess.run(['qemu-img', 'convert', '-f', 'qcow2', '-O', 'qcow2',
+                                '-o', 'preallocation=off',
+                                str(image_path), str(qcow2_file)], check=True)
+            self._grow_image(qcow2_file, 20)
 
             return qcow2_file
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to prepare cloud image: {e}")
             raise
 
+    def _grow_image(self, image: Path, size_gb: int) -> None:
+        """Resize image to size_gb unless its virtual size is already that large."""
+        result = subprocess.run(['qemu-img', 'info', '--output=json', str(image)],
+                                check=True, capture_output=True)
+        if json.loads(result.stdout)['virtual-size'] < size_gb * 1024 ** 3:
+            subprocess.run(['qemu-img', 'resize', str(image), f'{size_gb}G'],
+                           check=True, capture_output=True)
+
+    def _base_version_path(self, base: Path) -> Path:
+        """Path of the hard link to base's current version, named after its mtime."""
+        return self.vm_dir / f".{base.stem}-{base.stat().st_mtime_ns}{base.suffix}"
+
+    def _versioned_base(self, base: Path) -> Path:
+        """Return a hard link to base named after its version, for overlays to back onto.
+
+        A forced re-download replaces base with a new file, so the linked
+        version, and every VM disk backed by it, is never modified.
+        """
+        versioned = self._base_version_path(base)
+        try:
+            os.link(base, versioned)
+        except FileExistsError:
+            pass
+        return versioned
+
+    def _prune_base_versions(self, base: Path) -> None:
+        """Remove versioned links of base that neither match it nor back a VM disk."""
+        in_use = set()
+        for name in self._metadata:
+            disk = self.vm_dir / f"{name}.qcow2"
+            if not disk.exists():
+                continue
+            # -U, since a running VM's qemu holds a lock on its disk
+            result = subprocess.run(['qemu-img', 'info', '-U', '--output=json', str(disk)],
+                                    capture_output=True)
+            if result.returncode != 0:
+                # Can't tell which version this disk needs, so keep them all
+                self.warn(f"Could not read the backing file of {disk}, keeping old base images")
+                return
+            backing = json.loads(result.stdout).get('backing-filename')
+            if backing:
+                in_use.add(Path(backing).name)
+        current = self._base_version_path(base).name if base.exists() else None
+        for version in self.vm_dir.glob(f".{base.stem}-*{base.suffix}"):
+            if version.name != current and version.name not in in_use:
+                version.unlink(missing_ok=True)
+        # Overlay templates from earlier versions of this tool back no disk
+        for template in self.vm_dir.glob(f"..{base.stem}-*-template.qcow2"):
+            template.unlink(missing_ok=True)
+
     def create_cloud_init_config(self, vm_name: str, vpc_name: str) -> None:
         """Create cloud-init configuration for the VM"""
         vpc = self.vpc_manager.get_vpc(vpc_name)
@@ -195,9 +350,6 @@ class VMManager:
         except Exception as e:
             raise VMError(f"Failed to allocate IPs: {str(e)}")
 
-        cloud_init_dir = self.vm_dir / "cloud-init" / vm_name
-        cloud_init_dir.mkdir(parents=True, exist_ok=True)
-
         # Create meta-data
         meta_data = f"""instance-id: {vm_name}
 local-hostname: {vm_name}
@@ -209,7 +361,6 @@ network-interfaces: |
   gateway {vpc.network[1]}
   dns-nameservers 8.8.8.8 8.8.4.4
 """
-        (cloud_init_dir / "meta-data").write_text(meta_data)
 
         # Create user-data with improved networking
         user_data = f"""#cloud-config
@@ -239,21 +390,21 @@ runcmd:
   - iptables -t nat -A POSTROUTING -o eth0 -j MASQUERADE
   - echo 1 > /proc/sys/net/ipv4/ip_forward
 """
-        (cloud_init_dir / "user-data").write_text(user_data)
         
+        # Create cloud-init ISO in-process from the in-memory files
+        iso = pycdlib.PyCdlib()
+        iso.new(joliet=3, rock_ridge='1.09', vol_ident='cidata')
         try:
-            # Create cloud-init ISO
-            subprocess.run([
-                'mkisofs',
-                '-output', str(self.vm_dir / f"{vm_name}-cloud-init.iso"),
-                '-volid', 'cidata',
-                '-joliet',
-                '-rock',
-                str(cloud_init_dir / "user-data"),
-                str(cloud_init_dir / "meta-data")
-            ], check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            raise VMError(f"Failed to create cloud-init ISO: {e.stderr.decode()}")
+            for iso_name, name, content in (('/USERDATA.;1', 'user-data', user_data),
+                                            ('/METADATA.;1', 'meta-data', meta_data)):
+                data = content.encode()
+                iso.add_fp(BytesIO(data), len(data), iso_name,
+                           rr_name=name, joliet_path=f"/{name}")
+            iso.write(str(self.vm_dir / f"{vm_name}-cloud-init.iso"))
+        except pycdlib.pycdlibexception.PyCdlibException as e:
+            raise VMError(f"Failed to create cloud-init ISO: {e}")
+        finally:
+            iso.close()
 
     def create_vm(self, vm_name: str, vpc_name: str) -> None:
         """Create a new VM in the specified VPC"""
@@ -268,28 +419,31 @@ runcmd:
             raise VMError(f"VM {vm_name} already exists")
 
         try:
-        # Create VM-specific snapshot
+            # Create VM-specific snapshot
             img_file = self.vm_dir / "ubuntu-cloudimg-arm64.img"
-        qcow2_file = self.vm_dir / f"{vm_name}.qcow2"
+            qcow2_file = self.vm_dir / f"{vm_name}.qcow2"
             
             if not img_file.exists():
                 raise VMError("Base Ubuntu image not found. Run setup with --force to download it.")
                 
-            # Create VM disk
-        subprocess.run(['qemu-img', 'convert', '-f', 'qcow2', '-O', 'qcow2', 
-                        str(img_file), str(qcow2_file)], check=True, capture_output=True)
-            subprocess.run(['qemu-img', 'resize', str(qcow2_file), '20G'], check=True, capture_output=True)
-
-            # Initialize metadata
+            # Create the VM disk as a small overlay on the base image rather
+            # than a full conversion of it. The overlay backs onto a
+            # versioned link that re-downloads never replace
+            base = self._versioned_base(img_file)
+            subprocess.run(['qemu-img', 'create', '-f', 'qcow2', '-F', 'qcow2',
+                            '-b', str(base.resolve()), str(qcow2_file), '20G'],
+                           check=True, capture_output=True)
+
+            # Initialize metadata; it is written out once, together with the
+            # IP allocation, by create_cloud_init_config
             self._metadata[vm_name] = {
                 "created_at": datetime.now().isoformat(),
                 "status": "created",
                 "vpc": vpc_name
             }
-            self._save_metadata()
 
             # Create cloud-init config
-        self.create_cloud_init_config(vm_name, vpc_name)
+            self.create_cloud_init_config(vm_name, vpc_name)
 
             self.log(f"VM {vm_name} created successfully in VPC {vpc_name}")
             
@@ -316,6 +470,8 @@ runcmd:
             if cloud_init_iso.exists():
                 cloud_init_iso.unlink()
 
+            (self.vm_dir / f"{vm_name}-qemu.log").unlink(missing_ok=True)
+
             # Release IPs if allocated
             if vm_name in self._metadata:
                 vpc_name = self._metadata[vm_name].get("vpc")
@@ -329,6 +485,9 @@ runcmd:
                 del self._metadata[vm_name]
                 self._save_metadata()
 
+            # The VM's disk may have been the last one on an old base version
+            self._prune_base_versions(self.vm_dir / "ubuntu-cloudimg-arm64.img")
+
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
 
@@ -347,13 +506,54 @@ runcmd:
             
         # Try to get process info
         try:
-            result = subprocess.run(['ps', 'aux'], capture_output=True, text=True)
-            vm_data["status"] = "running" if f'-name {name}' in result.stdout else "stopped"
+            vm_data["status"] = "running" if self._find_vm_pid(name) else "stopped"
         except subprocess.CalledProcessError:
             vm_data["status"] = "unknown"
             
         return vm_data
 
+    def _find_vm_pid(self, name: str) -> Optional[int]:
+        """Return the PID of a VM's QEMU process, or None if it isn't running"""
+        pid = self._vm_pid_cache.get(name) or self._metadata.get(name, {}).get("pid")
+        if pid:
+            # Check the recorded PID directly instead of scanning the process
+            # table, making sure it wasn't reused by an unrelated process
+            if self._is_vm_process(pid, name):
+                self._vm_pid_cache[name] = pid
+                return pid
+            self._vm_pid_cache.pop(name, None)
+            return None
+
+        # No PID recorded (e.g. started outside this tool): scan for it once
+        result = subprocess.run(['ps', 'axo', 'pid=,command='], capture_output=True, text=True)
+        for line in result.stdout.splitlines():
+            pid_str, _, command = line.strip().partition(' ')
+            if self._has_vm_name(command.split(), name):
+                pid = int(pid_str)
+                self._vm_pid_cache[name] = pid
+                return pid
+        return None
+
+    @staticmethod
+    def _has_vm_name(args: List[str], name: str) -> bool:
+        """Check a QEMU command line for '-name <name>'"""
+        return any(a == '-name' and b == name for a, b in zip(args, args[1:]))
+
+    def _is_vm_process(self, pid: int, name: str) -> bool:
+        """Check that pid is alive and is the QEMU process for VM name"""
+        try:
+            args = Path(f"/proc/{pid}/cmdline").read_bytes().decode(errors='replace').split('\0')
+        except FileNotFoundError:
+            if Path("/proc/self").exists():
+                return False  # procfs is mounted, so the process is gone
+            # No procfs (macOS): read the command line from ps instead
+            result = subprocess.run(['ps', '-p', str(pid), '-o', 'command='],
+                                    capture_output=True, text=True)
+            args = result.stdout.split()
+        except OSError:
+            return False
+        return self._has_vm_name(args, name)
+
     def start_vm(self, name: str) -> None:
         """Start a VM"""
         vm_data = self.get_vm_status(name)
@@ -387,12 +587,18 @@ runcmd:
                 '-nographic'
             ]
             
-            # Start in background
-            subprocess.Popen(cmd, 
-                           stdout=subprocess.DEVNULL,
-                           stderr=subprocess.DEVNULL)
+            # Start in background, detached from this CLI's session so QEMU
+            # outlives it, with console output kept for debugging
+            with open(self.vm_dir / f"{name}-qemu.log", 'wb') as log_file:
+                process = subprocess.Popen(cmd, 
+                                           stdin=subprocess.DEVNULL,
+                                           stdout=log_file,
+                                           stderr=subprocess.STDOUT,
+                                           start_new_session=True)
+            self._vm_pid_cache[name] = process.pid
             
             # Update metadata
+            self._metadata[name]["pid"] = process.pid
             self._metadata[name]["ssh_port"] = ssh_port
             self._metadata[name]["last_started"] = datetime.now().isoformat()
             self._save_metadata()
@@ -414,21 +620,20 @@ runcmd:
             
         try:
             # Find the QEMU process
-        result = subprocess.run(['ps', 'aux'], capture_output=True, text=True)
-        for line in result.stdout.splitlines():
-                if f'-name {name}' in line:
-                pid = line.split()[1]
-                    signal = 9 if force else 15  # SIGKILL if force, else SIGTERM
-                    subprocess.run(['kill', f'-{signal}', pid], check=True)
-                    
-                    # Update metadata
-                    self._metadata[name]["last_stopped"] = datetime.now().isoformat()
-                    self._save_metadata()
-                    
-                    self.log(f"VM '{name}' stopped")
-                    return
+            pid = self._find_vm_pid(name)
+            if pid and self._is_vm_process(pid, name):
+                os.kill(pid, signal.SIGKILL if force else signal.SIGTERM)
+                self._vm_pid_cache.pop(name, None)
+                
+                # Update metadata
+                self._metadata[name].pop("pid", None)
+                self._metadata[name]["last_stopped"] = datetime.now().isoformat()
+                self._save_metadata()
+                
+                self.log(f"VM '{name}' stopped")
+                return
                     
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             raise VMError(f"Failed to stop VM: {str(e)}")
 
     def delete_vm(self, name: str) -> None: